@@ -3,12 +3,36 @@ import re
 import sys
 import glob
 import logging
+import time
+import argparse
+import multiprocessing
+from contextlib import closing
+import hashlib
+import json
+import sqlite3
+from functools import lru_cache
 from PyPDF2 import PdfReader
 from datetime import datetime
 import dateutil.parser
 from configparser import ConfigParser, NoSectionError, NoOptionError
 import pytz
 
+try:
+    import fitz  # PyMuPDF
+except ImportError:
+    fitz = None
+
+EXTRACTORS = ["fitz", "pypdf2"]
+
+TZINFOS = {"CEST": 3600, "JEN": 3600, "IEE": 3600 }  # CEST is +1 hour from UTC, hence 3600 seconds
+# Number of distinct date strings whose parse result is kept; email headers repeat the same few
+DATE_CACHE_SIZE = 65536
+# Results between commits of the index
+INDEX_COMMIT_FILES = 100
+
+# Settings of a date worker, set by init_date_worker
+_worker_settings = None
+
 def get_script_dir():
     return os.path.dirname(os.path.abspath(__file__))
 
@@ -18,6 +42,13 @@ logging_file = os.path.join(script_dir, os.path.basename(sys.argv[0]).replace('.
 logging.basicConfig(filename=logging_file, level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Index of the files read before, keyed by content hash so it survives the renames
+index_file = os.path.join(script_dir, os.path.basename(sys.argv[0]).replace('.py', '.index.db'))
+# Journal of the renames of the last run, applied in one batch at the end of the run
+journal_file = os.path.join(script_dir, os.path.basename(sys.argv[0]).replace('.py', '.journal.json'))
+# The applied journal a new journal replaced, so --undo still has it after a --plan
+previous_journal_file = os.path.join(script_dir, os.path.basename(sys.argv[0]).replace('.py', '.journal.previous.json'))
+
 def read_config():
     script_dir = get_script_dir()
     config_file = os.path.join(script_dir, os.path.basename(sys.argv[0]).replace('.py', '.config'))
@@ -33,9 +64,10 @@ def read_config():
         search_on_next_line_after = config.get('DateSearchRules', 'SEARCH_ON_NEXT_LINE_AFTER', fallback='Datum').lower()
         search_subfolders = config.getboolean('ProcessingRules', 'SEARCH_SUBFOLDERS', fallback=True)
         redo = config.getboolean('ProcessingRules', 'REDO', fallback=False)
+        max_pages = max(1, config.getint('ProcessingRules', 'MAX_PAGES_TO_SEARCH', fallback=1))
         allowed_years = set(int(year) for year in config.get('DateValidation', 'ALLOWED_YEARS', fallback='').split(','))
         
-        return date_formats, date_identifiers, languages, search_on_next_line_after, search_subfolders, allowed_years, redo
+        return date_formats, date_identifiers, languages, search_on_next_line_after, search_subfolders, allowed_years, redo, max_pages
 
     except FileNotFoundError as e:
         print(f"Error: {e}")
@@ -57,7 +89,8 @@ def read_config():
 
     except ValueError as e:
         print(f"Error: {e}")
-        print("Help: The 'ALLOWED_YEARS' in the 'DateValidation' section should contain only numbers separated by commas.")
+        print("Help: The 'ALLOWED_YEARS' in the 'DateValidation' section should contain only numbers separated by commas,")
+        print("and 'MAX_PAGES_TO_SEARCH' in the 'ProcessingRules' section a single number.")
         sys.exit(1)
 
     except Exception as e:
@@ -78,42 +111,60 @@ def export_text(pdf_path, text):
         txt_file.write(text)
     logging.info(f"Exported text to {txt_path}")
 
-def extract_date_from_text(text, date_formats, date_identifiers, search_on_next_line_after, allowed_years):
-    tzinfos = {"CEST": 3600, "JEN": 3600, "IEE": 3600 }  # CEST is +1 hour from UTC, hence 3600 seconds
+def parse_date(date_str):
+    # dateutil's fuzzy parse, made naive; None when no date can be parsed
+    try:
+        parsed_date = dateutil.parser.parse(date_str, fuzzy=True, tzinfos=TZINFOS)
+    except ValueError:
+        return None
+    return parsed_date.replace(tzinfo=None) if parsed_date.tzinfo else parsed_date  # Make naive if it's timezone-aware
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def parse_date_cached(normalized_date_str):
+    return parse_date(normalized_date_str)
+
+def parse_date_memoized(date_str):
+    # The fuzzy parse splits on whitespace, so strings that only differ in whitespace share a cache entry
+    return parse_date_cached(" ".join(date_str.split()))
+
+@lru_cache(maxsize=None)
+def identifier_matcher(date_identifiers):
+    # One regular expression matching any of the identifiers, to skip the lines without any quickly
+    return re.compile("|".join(re.escape(identifier) for identifier in date_identifiers))
+
+def extract_date_from_text(text, date_formats, date_identifiers, search_on_next_line_after, allowed_years, memoize=True):
+    # memoize=False checks every identifier on every line and parses every candidate date string,
+    # as before the compiled matcher and parse cache; the result is the same
+    matcher = identifier_matcher(tuple(date_identifiers)) if memoize else None
+    parse = parse_date_memoized if memoize else parse_date
 
     lines = text.split('\n')
     found_dates = []
 
+    def add_date(date_str):
+        parsed_date = parse(date_str)
+        if parsed_date is None:
+            return  # No logging for unsuccessful parsing
+        if parsed_date.year in allowed_years:
+            found_dates.append(parsed_date)
+        else:
+            logging.info(f"Date {parsed_date.strftime('%Y%m%d')} discarded due to invalid year.")
+
     for i, line in enumerate(lines):
+        if matcher is not None and not matcher.search(line):
+            continue
         for identifier in date_identifiers:
             if identifier in line:
                 logging.info(f"Identifier '{identifier}' found on line: {line}")
                 if i + 2 < len(lines):  # Check if we can look at two more lines
                     potential_day = lines[i + 1].strip()
                     potential_date = lines[i + 2].strip()
-                    combined_date_str = f"{potential_day} {potential_date}"
-                    try:
-                        parsed_date = dateutil.parser.parse(combined_date_str, fuzzy=True, tzinfos=tzinfos)
-                        parsed_date = parsed_date.replace(tzinfo=None) if parsed_date.tzinfo else parsed_date  # Make naive if it's timezone-aware
-                        if parsed_date.year in allowed_years:
-                            found_dates.append(parsed_date)
-                        else:
-                            logging.info(f"Date {parsed_date.strftime('%Y%m%d')} discarded due to invalid year.")
-                    except ValueError:
-                        pass  # No logging for unsuccessful parsing
+                    add_date(f"{potential_day} {potential_date}")
 
                 date_str = line.split(identifier)[-1].strip()
                 if identifier.lower() == search_on_next_line_after:
                     date_str = lines[i + 1].strip() if i + 1 < len(lines) else ''
-                try:
-                    parsed_date = dateutil.parser.parse(date_str, fuzzy=True, tzinfos=tzinfos)
-                    parsed_date = parsed_date.replace(tzinfo=None) if parsed_date.tzinfo else parsed_date  # Make naive if it's timezone-aware
-                    if parsed_date.year in allowed_years:
-                        found_dates.append(parsed_date)
-                    else:
-                        logging.info(f"Date {parsed_date.strftime('%Y%m%d')} discarded due to invalid year.")
-                except ValueError:
-                    pass  # No logging for unsuccessful parsing
+                add_date(date_str)
 
     # If multiple dates found, return the first one
     if found_dates:
@@ -121,44 +172,252 @@ def extract_date_from_text(text, date_formats, date_identifiers, search_on_next_
     logging.info("No valid date found.")
     return None
     
-def rename_pdf(pdf_path, new_prefix, old_filename=None):
-    directory, filename = os.path.split(pdf_path)
-    if old_filename is None:
-        old_filename = filename
-    new_filename = f"{new_prefix} {old_filename}"
-    new_pdf_path = os.path.join(directory, new_filename)
+def benchmark(txt_dir):
+    # Extracts the dates of the .txt exports in txt_dir with and without the compiled matcher and
+    # parse cache, and checks that both find the same dates
+    date_formats, date_identifiers, languages, search_on_next_line_after, search_subfolders, allowed_years, redo, max_pages = read_config()
+    texts = []
+    for txt_path in sorted(glob.glob(os.path.join(txt_dir, '*.txt'))):
+        with open(txt_path, 'r', encoding='utf-8', errors='replace') as txt_file:
+            texts.append(txt_file.read())
+    if not texts:
+        print(f"No .txt files found in {txt_dir}.")
+        return
+    print(f"Benchmarking date extraction on {len(texts)} text files.")
+
+    logging.disable(logging.INFO)  # Log writes would dominate both runs
+    results = {}
+    for memoize in [False, True]:
+        parse_date_cached.cache_clear()
+        start_time = time.time()
+        results[memoize] = [extract_date_from_text(text, date_formats, date_identifiers, search_on_next_line_after,
+                                                   allowed_years, memoize) for text in texts]
+        elapsed_time = time.time() - start_time
+        name = "memoized" if memoize else "original"
+        print(f"  {name:9} {elapsed_time:.2f} seconds ({len(texts) / elapsed_time if elapsed_time > 0 else 0:.1f} files/s)")
+    logging.disable(logging.NOTSET)
+
+    cache = parse_date_cached.cache_info()
+    print(f"  Parse cache: {cache.hits} hits, {cache.misses} misses, {cache.currsize} entries")
+    differences = sum(a != b for a, b in zip(results[False], results[True]))
+    print(f"  Files with a different date: {differences}")
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def config_fingerprint(settings):
+    # Hash of everything the text and date of a file depend on; a change invalidates the index
+    values = dict(settings, allowed_years=sorted(settings["allowed_years"]))
+    return hashlib.sha256(json.dumps(values, sort_keys=True).encode('utf-8')).hexdigest()
+
+def open_index(path):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE IF NOT EXISTS files (sha256 TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, "
+                 "date TEXT, text TEXT NOT NULL, filename TEXT NOT NULL, updated REAL NOT NULL)")
+    return conn
+
+def load_index(conn, fingerprint):
+    # Dates of the files read with the current configuration, by content hash
+    rows = conn.execute("SELECT sha256, date FROM files WHERE fingerprint = ?", (fingerprint,))
+    return dict(rows)
+
+def index_text(conn, content_hash):
+    return conn.execute("SELECT text FROM files WHERE sha256 = ?", (content_hash,)).fetchone()[0]
+
+def update_index(conn, content_hash, fingerprint, text, date_found, filename):
+    conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                 (content_hash, fingerprint, date_found, text, filename, time.time()))
+
+def rename_pdf(pdf_path, new_pdf_path):
+    filename = os.path.basename(pdf_path)
+    new_filename = os.path.basename(new_pdf_path)
     os.rename(pdf_path, new_pdf_path)
     logging.info(f"Renamed: {filename} -> {new_filename}")
     print(f"Renamed: {filename}\n         {new_filename}")
 
-def process_pdf(pdf_path, date_formats, date_identifiers, languages, search_on_next_line_after, allowed_years, redo, index, total):
-    filename = os.path.basename(pdf_path)
-    logging.info(f"Processing PDF {index} of {total}: {filename}")
-    print(f"Processing PDF {index} of {total}: {filename}")
-    date_prefix = filename[:8]
-    
-    if is_valid_date(date_prefix) and not redo:  # already prefixed
-        return
+def plan_renames(renames):
+    # Drops the renames onto a name that is taken, by a file that is not renamed itself or by an
+    # earlier rename of the batch. Returns the renames kept and the collisions
+    sources = set(os.path.normcase(pdf_path) for pdf_path, new_pdf_path in renames)
+    targets = set()
+    kept = []
+    collisions = []
+    for pdf_path, new_pdf_path in renames:
+        target = os.path.normcase(new_pdf_path)
+        if target in targets or (os.path.exists(new_pdf_path) and target not in sources):
+            collisions.append((pdf_path, new_pdf_path))
+        else:
+            targets.add(target)
+            kept.append((pdf_path, new_pdf_path))
+    return kept, collisions
+
+def read_journal(path=journal_file):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+def save_journal(journal, path=journal_file):
+    # Written to a temporary file first, so a crash leaves either the old or the new journal
+    temp_file = path + '.tmp'
+    with open(temp_file, 'w', encoding='utf-8') as file:
+        json.dump(journal, file, indent=2)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_file, path)
+
+def start_journal(journal):
+    # Saves a new journal; an applied journal it replaces is kept as the previous journal
+    current = read_journal()
+    if current and current["status"] == "applied":
+        os.replace(journal_file, previous_journal_file)
+    save_journal(journal)
+
+def last_applied_journal():
+    # The journal of the last renames applied: the current journal, or the previous one when the
+    # current journal is only planned or was undone already
+    for path in [journal_file, previous_journal_file]:
+        journal = read_journal(path)
+        if journal and journal["status"] in ["applied", "applying"]:
+            return path, journal
+    return None, None
+
+def apply_journal(journal):
+    # Renames the files of the journal in one batch. Which renames are done is told by the files
+    # themselves, not recorded per rename, so a batch interrupted by a crash is completed or undone
+    # by running it again
+    journal["status"] = "applying"
+    save_journal(journal)
+    pending = [(rename["from"], rename["to"]) for rename in journal["renames"]]
+    renamed = 0
+    while pending:
+        # A target can be the source of another rename, retry those until no rename succeeds
+        remaining = []
+        for pdf_path, new_pdf_path in pending:
+            if os.path.exists(new_pdf_path):
+                if os.path.exists(pdf_path):
+                    remaining.append((pdf_path, new_pdf_path))
+                continue  # Renamed by an earlier attempt
+            if not os.path.exists(pdf_path):
+                logging.error(f"Not renamed, file is gone: {pdf_path}")
+                print(f"Not renamed, file is gone: {pdf_path}")
+                continue
+            rename_pdf(pdf_path, new_pdf_path)
+            renamed += 1
+        if len(remaining) == len(pending):
+            break
+        pending = remaining
+    for pdf_path, new_pdf_path in pending:
+        logging.error(f"Not renamed, name is taken: {pdf_path} -> {os.path.basename(new_pdf_path)}")
+        print(f"Not renamed, name is taken: {os.path.basename(pdf_path)}\n                            {os.path.basename(new_pdf_path)}")
+    journal["status"] = "applied"
+    save_journal(journal)
+    print(f"Renamed {renamed} of {len(journal['renames'])} files in the journal {journal_file}.")
+
+def undo_journal(journal, path=journal_file):
+    # Renames the files of the journal back, in reverse order; renames that were not done, or of
+    # files renamed again since, are skipped
+    undone = 0
+    for rename in reversed(journal["renames"]):
+        pdf_path, new_pdf_path = rename["from"], rename["to"]
+        if os.path.exists(new_pdf_path) and not os.path.exists(pdf_path):
+            rename_pdf(new_pdf_path, pdf_path)
+            undone += 1
+    journal["status"] = "undone"
+    save_journal(journal, path)
+    print(f"Renamed {undone} of {len(journal['renames'])} files in the journal {path} back.")
 
+def read_pages(pdf_path, extractor="fitz", max_pages=1):
+    # Yields the text of the first max_pages pages one at a time, so a caller that stops early
+    # doesn't pay for the pages after. PyMuPDF only parses what it needs for a page, PdfReader
+    # parses the whole cross-reference table up front. Falls back to PyPDF2 when PyMuPDF is
+    # missing or can't open the file.
+    if extractor == "fitz" and fitz is not None:
+        try:
+            doc = fitz.open(pdf_path)
+        except Exception as e:
+            logging.info(f"PyMuPDF could not read {pdf_path}, using PyPDF2: {e}")
+        else:
+            with doc:
+                for page_num in range(min(len(doc), max_pages)):
+                    yield doc[page_num].get_text()
+            return
     reader = PdfReader(pdf_path)
-    if len(reader.pages) > 0:
-        first_page = reader.pages[0]
-        text = first_page.extract_text()
-        export_text(pdf_path, text)
-        
-        date_found = extract_date_from_text(text, date_formats, date_identifiers, search_on_next_line_after, allowed_years)
-        if date_found:
-            if redo:
-                original_filename = re.sub(r'^\d{8} ', '', filename)
-                rename_pdf(pdf_path, date_found, original_filename)
-            else:
-                rename_pdf(pdf_path, date_found)
+    for page_num in range(min(len(reader.pages), max_pages)):
+        yield reader.pages[page_num].extract_text()
+
+def init_date_worker(settings):
+    global _worker_settings
+    _worker_settings = settings
+
+def date_pdf(pdf_path):
+    # Reads the pages one at a time until one has a date, up to max_pages; renaming is left to the
+    # main process, so workers never race on the same directory. The text is that of the pages
+    # read, separated by form feeds. A file whose content hash is in the index is not read, its
+    # date comes from the index (and text None)
+    settings = _worker_settings
+    index = settings["index"]
+    content_hash = None
+    try:
+        if index is not None:
+            content_hash = file_sha256(pdf_path)
+            if content_hash in index:
+                return pdf_path, content_hash, None, index[content_hash], None, True, 0
+        texts = []
+        date_found = None
+        with closing(read_pages(pdf_path, settings["extractor"], settings["max_pages"])) as pages:
+            for text in pages:
+                texts.append(text)
+                date_found = extract_date_from_text(text, settings["date_formats"], settings["date_identifiers"],
+                                                    settings["search_on_next_line_after"], settings["allowed_years"])
+                if date_found:
+                    break
+        if not texts:
+            return pdf_path, content_hash, None, None, None, False, 0
+        return pdf_path, content_hash, '\f'.join(texts), date_found, None, False, len(texts)
+    except Exception as e:
+        return pdf_path, content_hash, None, None, str(e), False, 0
+
+def new_name(filename, date_found, redo):
+    # Prefix and the name it goes in front of, or None when the file keeps its name
+    if date_found:
+        if redo:
+            original_filename = re.sub(r'^\d{8} ', '', filename)
         else:
-            if not filename.startswith("UNKNOWN_"):
-                rename_pdf(pdf_path, "UNKNOWN_", filename)   
-                
-def main(target):
-    date_formats, date_identifiers, languages, search_on_next_line_after, search_subfolders, allowed_years, redo = read_config()
+            original_filename = filename
+        prefix = date_found
+    else:
+        if filename.startswith("UNKNOWN_"):
+            return None
+        prefix, original_filename = "UNKNOWN_", filename
+    if f"{prefix} {original_filename}" == filename:
+        return None
+    return prefix, original_filename
+
+def apply_date(pdf_path, text, date_found, redo, export=True):
+    # Exports the text and returns the rename of the file, as (path, new path), or None. The
+    # renames are applied in one batch at the end of the run
+    filename = os.path.basename(pdf_path)
+    if export:
+        export_text(pdf_path, text)
+    rename = new_name(filename, date_found, redo)
+    if rename is None:
+        logging.info(f"Name unchanged: {filename}")
+        return None
+    new_prefix, old_filename = rename
+    return pdf_path, os.path.join(os.path.dirname(pdf_path), f"{new_prefix} {old_filename}")
+
+def main(target, workers=1, extractor="fitz", use_index=True, plan=False):
+    date_formats, date_identifiers, languages, search_on_next_line_after, search_subfolders, allowed_years, redo, max_pages = read_config()
+
+    journal = read_journal()
+    if journal and journal["status"] == "applying":
+        print("The renames of an earlier run were interrupted, completing them first (--undo renames them back).")
+        apply_journal(journal)
     
     pdf_files = []
     if '*' in target or '?' in target:
@@ -181,15 +440,120 @@ def main(target):
 
     total_files = len(pdf_files)
     print(f"Found {total_files} PDF files to process.")
-    for index, pdf_path in enumerate(pdf_files, 1):
-        process_pdf(pdf_path, date_formats, date_identifiers, languages, search_on_next_line_after, allowed_years, redo, index, total_files)
+    start_time = time.time()
+    # Already prefixed files are left alone, unless REDO is set
+    to_process = [pdf_path for pdf_path in pdf_files if redo or not is_valid_date(os.path.basename(pdf_path)[:8])]
+    settings = {"extractor": extractor, "date_formats": date_formats, "date_identifiers": date_identifiers,
+                "search_on_next_line_after": search_on_next_line_after, "allowed_years": allowed_years,
+                "max_pages": max_pages}
+    fingerprint = config_fingerprint(settings)
+    conn = None
+    if use_index:
+        conn = open_index(index_file)
+        settings["index"] = load_index(conn, fingerprint)
+    else:
+        settings["index"] = None
+    from_index = 0
+    renames = []
+    # Files read, of those the files that needed more than one page, and the pages read
+    files_read = 0
+    multi_page = 0
+    pages_read = 0
+
+    if workers > 1 and len(to_process) > 1:
+        pool = multiprocessing.Pool(min(workers, len(to_process)), initializer=init_date_worker, initargs=(settings,))
+        results = pool.imap_unordered(date_pdf, to_process, chunksize=16)
+    else:
+        pool = None
+        init_date_worker(settings)
+        results = map(date_pdf, to_process)
+
+    try:
+        for index, (pdf_path, content_hash, text, date_found, error, cached, pages) in enumerate(results, 1):
+            filename = os.path.basename(pdf_path)
+            logging.info(f"Processing PDF {index} of {len(to_process)}: {filename}")
+            print(f"Processing PDF {index} of {len(to_process)}: {filename}")
+            if error:
+                logging.error(f"Error reading {filename}: {error}")
+                print(f"Error reading {filename}: {error}")
+            elif cached:
+                # Unchanged since it was read with the current configuration; the text is only
+                # needed again when the file gets a new name or its export is missing, as after
+                # --plan and --apply
+                from_index += 1
+                logging.info(f"Date of {filename} taken from the index")
+                export = not plan and not os.path.exists(pdf_path.rsplit('.', 1)[0] + '.txt')
+                if export or new_name(filename, date_found, redo) is not None:
+                    text = index_text(conn, content_hash) if not plan else None
+                    rename = apply_date(pdf_path, text, date_found, redo, not plan)
+                    if rename:
+                        renames.append(rename)
+            elif text is not None:
+                files_read += 1
+                pages_read += pages
+                if pages > 1:
+                    multi_page += 1
+                    logging.info(f"Read {pages} pages of {filename}")
+                rename = apply_date(pdf_path, text, date_found, redo, not plan)
+                if rename:
+                    renames.append(rename)
+                if conn and not plan:
+                    # A planned file is not exported, so it must be read (and exported) again
+                    update_index(conn, content_hash, fingerprint, text, date_found, filename)
+                    if index % INDEX_COMMIT_FILES == 0:
+                        conn.commit()
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+        if conn:
+            conn.commit()
+            conn.close()
+
+    total_time = time.time() - start_time
+    print(f"Processed {len(to_process)} of {total_files} PDF files in {total_time:.2f} seconds "
+          f"({len(to_process) / total_time if total_time > 0 else 0:.1f} files/s).")
+    if files_read:
+        print(f"{multi_page} of {files_read} files read needed more than one page, "
+              f"{pages_read / files_read:.2f} pages read per file on average (at most {max_pages}).")
+    if use_index:
+        print(f"{from_index} unchanged files were not read again, their date was taken from {index_file}.")
+
+    renames, collisions = plan_renames(renames)
+    for pdf_path, new_pdf_path in collisions:
+        logging.error(f"Not renamed, name is taken: {pdf_path} -> {os.path.basename(new_pdf_path)}")
+        print(f"Not renamed, name is taken: {os.path.basename(pdf_path)}\n                            {os.path.basename(new_pdf_path)}")
+    if not renames:
+        # The journal of the last renames is kept for --undo
+        print("No files to rename.")
+        return
+    journal = {"created": datetime.now().isoformat(timespec='seconds'), "status": "planned",
+               "renames": [{"from": os.path.abspath(pdf_path), "to": os.path.abspath(new_pdf_path)}
+                           for pdf_path, new_pdf_path in renames]}
+    start_journal(journal)
+    if plan:
+        for pdf_path, new_pdf_path in renames:
+            print(f"Planned: {os.path.basename(pdf_path)}\n         {os.path.basename(new_pdf_path)}")
+        print(f"Planned {len(renames)} renames ({len(collisions)} names taken) in the journal {journal_file}, "
+              f"apply them with --apply.")
+    else:
+        apply_journal(journal)
 
 def show_help():
     print("Help for PDF Date Extraction and Renaming Script:")
     print("\nUsage:")
-    print("  python woo-datespec.py <pdf_file_or_directory_or_wildcard>")
+    print("  python woo-datespec.py <pdf_file_or_directory_or_wildcard> [--workers N] [--extractor fitz|pypdf2] [--no-index] [--plan]")
+    print("  python woo-datespec.py --apply | --undo")
     print("\nOptions:")
     print("  --help, -h   Show this help message and exit.")
+    print("  --workers N  Read the PDFs in N parallel processes (default: 1). Renaming is done by the main process.")
+    print("  --extractor  Text extractor for the first page: 'fitz' (PyMuPDF, fast, default) or 'pypdf2'.")
+    print("  --no-index   Read every PDF, instead of taking the date of files read before from the index.")
+    print("  --plan       Write the renames to the journal without renaming (or exporting) anything.")
+    print("  --apply      Rename the files as planned in the journal by --plan.")
+    print("  --undo       Rename the files of the last applied journal back to their names before that run.")
+    print("  --benchmark <txt_dir>  Time the date extraction on the .txt exports in txt_dir with and without")
+    print("               the compiled identifier matcher and parse cache, and check both find the same dates.")
     print("\nDescription:")
     print("  This script searches for dates within PDF files based on specified identifiers in a configuration file.")
     print("  It renames the PDF files by adding a date at the beginning of the filename if found. If no date is found,")
@@ -200,7 +564,13 @@ def show_help():
     print("  - Date Validation: Ensures dates are within allowed years specified in the configuration.")
     print("  - Redo Option: When enabled, forces re-evaluation of all files, potentially renaming them even if previously named with a date.")
     print("  - Subfolder Search: Optionally searches for PDFs in subdirectories.")
-    print("  - Text Extraction: Extracts and saves the first page's text of each PDF to a .txt file.")
+    print(f"  - Rename Journal: The renames are written to '{os.path.basename(journal_file)}' in the script's directory and applied")
+    print("    in one batch at the end of the run, skipping names that are taken. A batch interrupted by a crash is completed")
+    print("    by the next run, or rolled back with --undo.")
+    print("  - Multi-page Search: Reads the pages one at a time until a date is found, up to MAX_PAGES_TO_SEARCH (default 1).")
+    print("  - Text Extraction: Extracts and saves the text of the pages read of each PDF to a .txt file.")
+    print("  - Index: Remembers the text and date of every PDF read by content hash, so reruns only read new or changed")
+    print("    files, or all files after a change of the configuration. A file keeps its index entry when it is renamed.")
     print("  - Logging: Logs operations and errors to a file named after the script with a .log extension.")
     
     print("\nConfiguration:")
@@ -222,11 +592,41 @@ if __name__ == "__main__":
     if len(sys.argv) < 2 or sys.argv[1] in ['--help', '-h']:
         show_help()
         sys.exit(0)
-    
-    if len(sys.argv) != 2:
+
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('target', nargs='?')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--extractor', choices=EXTRACTORS, default="fitz")
+    parser.add_argument('--benchmark', metavar='txt_dir')
+    parser.add_argument('--no-index', action='store_true')
+    parser.add_argument('--plan', action='store_true')
+    parser.add_argument('--apply', action='store_true')
+    parser.add_argument('--undo', action='store_true')
+    args, unknown = parser.parse_known_args()
+    if args.benchmark:
+        benchmark(args.benchmark)
+        sys.exit(0)
+    if args.undo:
+        path, journal = last_applied_journal()
+        if journal is None:
+            print(f"Error: No applied journal found at {journal_file}.")
+            sys.exit(1)
+        undo_journal(journal, path)
+        sys.exit(0)
+    if args.apply:
+        journal = read_journal()
+        if journal is None:
+            print(f"Error: No journal found at {journal_file}.")
+            sys.exit(1)
+        if journal["status"] in ["planned", "applying"]:
+            apply_journal(journal)
+        else:
+            print(f"Error: The journal at {journal_file} was already {journal['status']}.")
+            sys.exit(1)
+        sys.exit(0)
+    if unknown or args.workers < 1 or not args.target:
         show_help()
         logging.error("Script usage error: Missing argument for PDF file, directory, or wildcard path.")
         sys.exit(1)
-    
-    target = sys.argv[1]
-    main(target)
+
+    main(args.target, args.workers, args.extractor, not args.no_index, args.plan)
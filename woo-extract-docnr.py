@@ -1,132 +1,409 @@
 import sys
 import fitz  # PyMuPDF
 from PIL import Image
-import pytesseract
+import woo_ocr
+import woo_largefile
 import re
 import itertools
 from operator import itemgetter
+from collections import Counter
 import time
 import os
 import re
 import numpy as np
 import cv2
-from threading import Timer
-
-# Define timeout handler
-def timeout_handler():
-    print("Script execution has exceeded the time limit. Aborting.")
-    sys.exit(1)
-
-# Set up timeout
-class Timeout:
-    def __init__(self, seconds=1, error_message='Timeout'):
-        self.seconds = seconds
-        self.error_message = error_message
-    def handle_timeout(self, signum, frame):
-        raise TimeoutError(self.error_message)
-    def __enter__(self):
-        self.timer = Timer(self.seconds, timeout_handler)
-        self.timer.start()
-    def __exit__(self, type, value, traceback):
-        self.timer.cancel()
+import argparse
+import multiprocessing
+import json
+import signal
+from multiprocessing.connection import wait
+from collections import deque
+
+CORNERS = ["top-left", "top-right", "bottom-left", "bottom-right"]
+# Strategy that only looks for a red box, and the corner argument that lets the script choose
+RED_BOX = "red-box"
+AUTO = "auto"
+# Order in which the auto mode probes, the first one wins a tie
+AUTO_CANDIDATES = ["top-right", "top-left", "bottom-right", "bottom-left", RED_BOX]
+# Number of pages probed by the auto mode, and the fraction of them that should have a number
+AUTO_SAMPLES = 12
+AUTO_MIN_CONFIDENCE = 0.5
+RENDER_DPI = 300
+# Ways a document number can be resolved, reported in the run summary
+METHOD_TEXT = "text layer"
+METHOD_OCR = "OCR"
+METHOD_RED_BOX = "red box"
+METHOD_INFERRED = "inferred"
+METHOD_TIMEOUT = "timed out"
+METHOD_FAILED = "failed"
+# Seconds a single page may take before its worker is killed and replaced
+PAGE_TIMEOUT = 120
+# Confidence recorded for numbers read from the text layer
+TEXT_LAYER_CONF = 100.0
+# Distance between the sampled pages of a sparse scan
+SPARSE_STEP = 8
+# Size of the corner box searched for the document number, in PDF points (500 px at 300 DPI)
+CORNER_BOX_PT = 120
 
-def extract_document_number(page, page_num, total_pages, corner):
+# Per-process state for page workers, set by init_page_worker
+_worker_doc = None
+_worker_corner = None
+_worker_dpi = RENDER_DPI
+_worker_red_box_fallback = True
+
+def corner_rect(page_rect, corner):
     """
-    Extracts the document number from the specified corner of a PDF page.
+    Returns the area of the page, in PDF points, where the document number is searched.
 
-    :param page: A fitz.Page object from PyMuPDF
-    :param page_num: The number of the current page
-    :param total_pages: Total number of pages in the document
+    :param page_rect: The fitz.Rect of the page
     :param corner: The corner where the document number is located
-    :return: Extracted document number or None if not found
-    """
-    # Render page at a reasonable resolution
-    pix = page.get_pixmap(matrix=fitz.Matrix(300/72, 300/72))
-    img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-
-    # Define cropping area based on corner
-    width, height = img.size
-    boxsize2 = 500
-    boxsize1 = 500
-    x1, y1, x2, y2 = {
-        "top-left": (0, 0, boxsize1, boxsize2),
-        "top-right": (width - boxsize1, 0, width, boxsize2),
-        "bottom-left": (0, height - boxsize2, boxsize1, height),
-        "bottom-right": (width - boxsize1, height - boxsize2, width, height)
-    }.get(corner, (width - boxsize1, 0, width, boxsize2))  # Default to top-right if invalid corner
-
-    cropped = img.crop((x1, y1, x2, y2))
-
-    # Perform OCR on the cropped image
-    text = pytesseract.image_to_string(cropped)
-    # Use regex to find a number or document number pattern
+    :return: fitz.Rect of the corner box
+    """
+    r, size = page_rect, CORNER_BOX_PT
+    return {
+        "top-left": fitz.Rect(r.x0, r.y0, r.x0 + size, r.y0 + size),
+        "top-right": fitz.Rect(r.x1 - size, r.y0, r.x1, r.y0 + size),
+        "bottom-left": fitz.Rect(r.x0, r.y1 - size, r.x0 + size, r.y1),
+        "bottom-right": fitz.Rect(r.x1 - size, r.y1 - size, r.x1, r.y1)
+    }.get(corner, fitz.Rect(r.x1 - size, r.y0, r.x1, r.y0 + size))  # Default to top-right if invalid corner
+
+def red_box_rect(page_rect):
+    """
+    Returns the area of the page, in PDF points, searched for a red box: the top-right quarter.
+
+    :param page_rect: The fitz.Rect of the page
+    :return: fitz.Rect of the region of interest
+    """
+    r = page_rect
+    return fitz.Rect(r.x0 + r.width * 3 / 4, r.y0, r.x1, r.y0 + r.height / 4)
+
+def render_clip(page, clip, dpi=RENDER_DPI):
+    """
+    Renders only the given area of a page, instead of rasterizing the full page and cropping it.
+
+    :param page: A fitz.Page object from PyMuPDF
+    :param clip: fitz.Rect in PDF points to render
+    :param dpi: Render resolution
+    :return: PIL Image of the clipped area
+    """
+    pix = page.get_pixmap(matrix=fitz.Matrix(dpi / 72, dpi / 72), clip=clip)
+    return Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+
+def find_document_number(text):
+    """
+    Finds the first number or document number pattern in a piece of text.
+
+    :param text: Text read from the corner of a page
+    :return: The document number or None if not found
+    """
     match = re.search(r'\b\d{1,}\b', text)  # Adjust regex as needed
-    doc_number = match.group() if match else None
-    
-    if not doc_number:
-        # def extract_document_number_from_red_box(input_pdf, page_number=0):
+    return match.group() if match else None
+
+def extract_document_number_from_red_box(page, dpi=RENDER_DPI):
+    """
+    Extracts document number from a red box in the top-right corner of a PDF page.
+
+    :param page: A fitz.Page object from PyMuPDF
+    :param dpi: Resolution at which the red box area is rendered
+    :return: Tuple of (extracted document number or None if not found, OCR confidence or None)
+    """
+    # Render the region of interest (ROI) - top-right corner - as numpy array for OpenCV
+    roi = np.array(render_clip(page, red_box_rect(page.rect), dpi))  # You might need to adjust red_box_rect based on your PDF's layout
+
+    # Convert ROI to HSV color space for easier color detection
+    hsv_roi = cv2.cvtColor(roi, cv2.COLOR_RGB2HSV)
+
+    # Define range for red color in HSV
+    lower_red = np.array([0, 50, 50])
+    upper_red = np.array([10, 255, 255])
+
+    # Create mask for red color
+    mask = cv2.inRange(hsv_roi, lower_red, upper_red)
+
+    # Find contours in the mask
+    contours, _ = cv2.findContours(mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+
+    # Look for the largest contour which might be the red box
+    if contours:
+        largest_contour = max(contours, key=cv2.contourArea)
+        
+        # Get the bounding rectangle
+        x, y, w, h = cv2.boundingRect(largest_contour)
+        
+        # Crop the region inside the red box
+        red_box = roi[y:y+h, x:x+w]
+
+        # Convert the cropped area back to PIL Image for OCR
+        red_box_pil = Image.fromarray(red_box)
+        
+        # Use Tesseract to recognize text
+        text, conf = woo_ocr.get_backend().image_to_string_conf(red_box_pil, psm=6, dpi=dpi)
+        
+        # Use regex to extract what looks like a document number
+        match = re.search(r'\b\d+\b', text)  # Assuming the document number is a sequence of digits
+        if match:
+            return match.group(), conf
+        # else:
+            # print("No document number found in the red box.")
+    else:
+        print("No red box detected on the page.")
+    return None, None
+
+def extract_document_number(page, corner, dpi=RENDER_DPI, red_box_fallback=True):
+    """
+    Extracts the document number from the specified corner of a PDF page.
+
+    The existing text layer inside the corner box is tried first; the corner is only rendered
+    and OCR'd when that yields no number, and the red box is the last resort.
+
+    :param page: A fitz.Page object from PyMuPDF
+    :param corner: The corner where the document number is located, or RED_BOX to only look for a red box
+    :param dpi: Resolution at which the corner and red box areas are rendered
+    :param red_box_fallback: Look for a red box when the corner has no number
+    :return: Tuple of (document number or None if not found, method that found it or None,
+             OCR confidence or None). A page with a blank or redacted corner, where the red box
+             finds nothing either, gets woo_ocr.PAGE_BLANK or woo_ocr.PAGE_REDACTED as method.
+    """
+    corner_class = woo_ocr.PAGE_CONTENT
+    if corner != RED_BOX:
+        clip = corner_rect(page.rect, corner)
+
+        # Words of the text layer inside the corner box, in reading order
+        words = page.get_text("words", clip=clip, sort=True)
+        doc_number = find_document_number(" ".join(word[4] for word in words))
+        if doc_number:
+            return doc_number, METHOD_TEXT, TEXT_LAYER_CONF
+
+        # Render just the corner box, the rest of the page is never looked at
+        cropped = render_clip(page, clip, dpi)
+
+        # OCR is skipped for an empty or blacked out corner
+        corner_class = woo_ocr.classify_image(cropped, dpi)
+        if corner_class == woo_ocr.PAGE_CONTENT:
+            # Perform OCR on the cropped image
+            text, conf = woo_ocr.get_backend().image_to_string_conf(cropped, dpi=dpi)
+            # Use regex to find a number or document number pattern
+            doc_number = find_document_number(text)
+            if doc_number:
+                return doc_number, METHOD_OCR, conf
+
+        if not red_box_fallback:
+            return None, (None if corner_class == woo_ocr.PAGE_CONTENT else corner_class), None
+
+    doc_number, conf = extract_document_number_from_red_box(page, dpi)
+    if doc_number:
+        return doc_number, METHOD_RED_BOX, conf
+    return None, (None if corner_class == woo_ocr.PAGE_CONTENT else corner_class), None
+
+def detect_corner(input_pdf, total_pages, dpi=RENDER_DPI, samples=AUTO_SAMPLES, workers=1, page_timeout=PAGE_TIMEOUT):
+    """
+    Picks the corner (or the red box) holding the document numbers by probing a sample of pages.
+
+    Each candidate is scored on the sample pages where it finds a number, plus the pairs of
+    consecutive finds that don't go down, as document numbers run up through a bundle. Probing
+    stops early as soon as a candidate finds an ascending number on every sample page. The probes
+    run in a PageWorkerPool like the scan, so a probe that fails or times out counts as a miss.
+
+    :param input_pdf: Path to the PDF file
+    :param total_pages: Number of pages in the PDF
+    :param dpi: Resolution at which the corner areas are rendered
+    :param samples: Number of pages, spread over the document, to probe
+    :param workers: Number of worker processes to spread the sample pages over
+    :param page_timeout: Seconds a single probe may take before it is given up, 0 for no limit
+    :return: Tuple of (corner or RED_BOX, fraction of the sample pages on which it found a number)
+    """
+    sample_pages = sorted({1 + round(i * (total_pages - 1) / max(1, samples - 1)) for i in range(samples)})
+    best, best_score, best_hits = AUTO_CANDIDATES[0], -1, 0
+    for candidate in AUTO_CANDIDATES:
+        with PageWorkerPool(input_pdf, candidate, dpi, workers, page_timeout, red_box_fallback=False) as pool:
+            results = list(pool.imap(sample_pages))
+        found = [int(doc_number) for _, doc_number, _, _ in results if doc_number]
+        errors = sum(method in (METHOD_TIMEOUT, METHOD_FAILED) for _, _, method, _ in results)
+        ascending = sum(b >= a for a, b in zip(found, found[1:]))
+        score = len(found) + ascending
+        print(f"Probing {candidate}: number found on {len(found)}/{len(sample_pages)} sample pages, "
+              f"{ascending}/{max(0, len(found) - 1)} steps ascending"
+              + (f", {errors} probes failed or timed out" if errors else ""))
+        if score > best_score:
+            best, best_score, best_hits = candidate, score, len(found)
+        if len(found) == len(sample_pages) and ascending == len(found) - 1:
+            break
+    return best, best_hits / len(sample_pages)
+
+def init_page_worker(input_pdf, corner, dpi=RENDER_DPI, red_box_fallback=True):
+    """
+    Opens a private fitz document for the current process. fitz documents can't be shared
+    between processes, so every pool worker (or the main process in a serial run) opens its own.
+
+    :param input_pdf: Path to the PDF file
+    :param corner: The corner where document numbers are expected to be found
+    :param dpi: Resolution at which the corner areas are rendered
+    :param red_box_fallback: Look for a red box when the corner has no number
+    """
+    global _worker_doc, _worker_corner, _worker_dpi, _worker_red_box_fallback
+    _worker_doc = fitz.open(input_pdf)
+    _worker_corner = corner
+    _worker_dpi = dpi
+    _worker_red_box_fallback = red_box_fallback
+
+def scan_page(page_num):
+    """
+    Extracts the document number of a single page using the document opened by init_page_worker.
+
+    :param page_num: The 1-based page number
+    :return: Tuple of (page_num, doc_number, method, conf)
+    """
+    page = _worker_doc[page_num - 1]
+    result = (page_num,) + extract_document_number(page, _worker_corner, _worker_dpi, _worker_red_box_fallback)
+    woo_largefile.release_page_cache()
+    return result
+
+def scan_page_safe(page_num):
+    """
+    scan_page, reporting a page whose scan raises as failed instead of raising.
+    """
+    try:
+        return scan_page(page_num)
+    except Exception as e:
+        print(f"Error processing page {page_num}: {e}")
+        return page_num, None, METHOD_FAILED, None
+
+def kill_worker(process):
+    """
+    Kills a page worker together with the processes it started, like the tesseract processes of
+    the pytesseract backend, which would otherwise keep running after a timeout.
+
+    :param process: multiprocessing.Process of the worker
+    """
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (AttributeError, ProcessLookupError, PermissionError):
+        # No process groups on this platform, or the worker didn't get to start its own group
+        process.kill()
+
+def page_worker_main(conn, input_pdf, corner, dpi, red_box_fallback=True):
+    """
+    Main loop of a page worker process: receives page numbers and sends back their scan results
+    until it receives None.
+
+    :param conn: Worker end of the pipe to the PageWorkerPool
+    """
+    if hasattr(os, "setpgid"):
+        # A process group of its own, so kill_worker also stops the tesseract processes it started
+        os.setpgid(0, 0)
+    init_page_worker(input_pdf, corner, dpi, red_box_fallback)
+    while True:
+        page_num = conn.recv()
+        if page_num is None:
+            break
+        conn.send(scan_page_safe(page_num))
+
+class PageWorkerPool:
+    """
+    Scans pages in worker processes that each open their own fitz document and get one page at
+    a time. A worker that doesn't finish its page within page_timeout seconds is killed and
+    replaced, and the page is reported as timed out instead of stalling the whole scan.
+
+    With one worker and no page timeout the pages are scanned in the main process.
+    """
+    def __init__(self, input_pdf, corner, dpi=RENDER_DPI, workers=1, page_timeout=PAGE_TIMEOUT, red_box_fallback=True):
+        self.input_pdf = input_pdf
+        self.corner = corner
+        self.dpi = dpi
+        self.red_box_fallback = red_box_fallback
+        self.page_timeout = page_timeout
+        self.in_process = workers <= 1 and not page_timeout
+        self.workers = [] if self.in_process else [self._start_worker() for _ in range(workers)]
+        if self.in_process:
+            init_page_worker(input_pdf, corner, dpi, red_box_fallback)
+
+    def _start_worker(self):
+        conn, child_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=page_worker_main, daemon=True,
+                                          args=(child_conn, self.input_pdf, self.corner, self.dpi, self.red_box_fallback))
+        process.start()
+        child_conn.close()
+        return {"process": process, "conn": conn, "page": None, "started": None}
+
+    def _replace_worker(self, index):
+        worker = self.workers[index]
+        kill_worker(worker["process"])
+        worker["process"].join()
+        worker["conn"].close()
+        self.workers[index] = self._start_worker()
+
+    def imap(self, page_nums):
         """
-        Extracts document number from a red box in the top-right corner of a PDF page.
+        Scans the given pages.
 
-        :param input_pdf: Path to the PDF file
-        :param page_number: Page number to extract from (default is 0 for the first page)
-        :return: Extracted document number or None if not found
+        :param page_nums: Iterable of 1-based page numbers
+        :return: Generator of (page_num, doc_number, method, conf) tuples, in the order of page_nums
         """
-        # Convert PIL Image to numpy array for OpenCV
-        np_img = np.array(img)
-
-        # Define the region of interest (ROI) - top-right corner
-        height, width = np_img.shape[:2]
-        roi = np_img[0:int(height/4), int(width*3/4):width]  # You might need to adjust these based on your PDF's layout
-
-        # Convert ROI to HSV color space for easier color detection
-        hsv_roi = cv2.cvtColor(roi, cv2.COLOR_RGB2HSV)
-
-        # Define range for red color in HSV
-        lower_red = np.array([0, 50, 50])
-        upper_red = np.array([10, 255, 255])
-
-        # Create mask for red color
-        mask = cv2.inRange(hsv_roi, lower_red, upper_red)
-
-        # Find contours in the mask
-        contours, _ = cv2.findContours(mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-
-        # Look for the largest contour which might be the red box
-        if contours:
-            largest_contour = max(contours, key=cv2.contourArea)
-            
-            # Get the bounding rectangle
-            x, y, w, h = cv2.boundingRect(largest_contour)
-            
-            # Crop the region inside the red box
-            red_box = roi[y:y+h, x:x+w]
-
-            # Convert the cropped area back to PIL Image for OCR
-            red_box_pil = Image.fromarray(red_box)
-            
-            # Use Tesseract to recognize text
-            text = pytesseract.image_to_string(red_box_pil, config='--psm 6')
-            
-            # Use regex to extract what looks like a document number
-            # import re
-            match = re.search(r'\b\d+\b', text)  # Assuming the document number is a sequence of digits
-            if match:
-                doc_number = match
-            # else:
-                # print("No document number found in the red box.")
-        else:
-            print("No red box detected on the page.")
-            
-    
-    # Time estimation
-    elapsed_time = time.time() - start_time
-    avg_time_per_page = elapsed_time / page_num if page_num > 0 else 0
-    remaining_time = avg_time_per_page * (total_pages - page_num + 1)
-    
-    print(f"Processing page {page_num}/{total_pages}: OCR'd document number is {doc_number if doc_number else 'not found'} "
-          f"| Estimated remaining time: {remaining_time:.0f} seconds")
-    return doc_number
+        page_nums = list(page_nums)
+        if self.in_process:
+            for page_num in page_nums:
+                yield scan_page_safe(page_num)
+            return
+
+        pending = deque(page_nums)
+        results = {}
+        next_index = 0
+        while next_index < len(page_nums):
+            for worker in self.workers:
+                if worker["page"] is None and pending:
+                    worker["page"], worker["started"] = pending.popleft(), time.time()
+                    worker["conn"].send(worker["page"])
+
+            busy = [worker for worker in self.workers if worker["page"] is not None]
+            timeout = None
+            if self.page_timeout:
+                timeout = max(0, min(worker["started"] + self.page_timeout for worker in busy) - time.time())
+            ready = wait([worker["conn"] for worker in busy], timeout)
+
+            for index, worker in enumerate(self.workers):
+                page_num = worker["page"]
+                if page_num is None:
+                    continue
+                if worker["conn"] in ready:
+                    try:
+                        results[page_num] = worker["conn"].recv()
+                        worker["page"] = None
+                    except EOFError:
+                        print(f"Worker scanning page {page_num} died. Page recorded as unresolved.")
+                        results[page_num] = (page_num, None, METHOD_FAILED, None)
+                        self._replace_worker(index)
+                elif self.page_timeout and time.time() - worker["started"] > self.page_timeout:
+                    print(f"Page {page_num} exceeded the time limit of {self.page_timeout} seconds. Page recorded as unresolved.")
+                    results[page_num] = (page_num, None, METHOD_TIMEOUT, None)
+                    self._replace_worker(index)
+
+            # Hand results back in page order
+            while next_index < len(page_nums) and page_nums[next_index] in results:
+                yield results.pop(page_nums[next_index])
+                next_index += 1
+
+    def close(self):
+        global _worker_doc
+        if self.in_process and _worker_doc is not None:
+            _worker_doc.close()
+            _worker_doc = None
+        for worker in self.workers:
+            try:
+                worker["conn"].send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for worker in self.workers:
+            worker["process"].join(timeout=5)
+            if worker["process"].is_alive():
+                kill_worker(worker["process"])
+            worker["conn"].close()
+        self.workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
 
 def pages_to_ranges(pages):
     """
@@ -145,56 +422,250 @@ def pages_to_ranges(pages):
             ranges.append(f"{group[0]}-{group[-1]}")
     return ", ".join(ranges)
 
-def process_pdf(input_pdf, corner):
+def open_checkpoint(checkpoint_file, settings, resume=False):
+    """
+    Opens the append-only checkpoint of a scan, one JSON line per scanned page.
+
+    The first line records the scan settings, so a resumed scan can't mix in pages that were
+    read from another corner or at another resolution.
+
+    :param checkpoint_file: Path to the checkpoint file
+    :param settings: Dict of the scan settings
+    :param resume: Keep the pages of an existing checkpoint instead of starting over, except those that timed out or failed
+    :return: Tuple of (file object opened for appending, dict of page_num -> (doc_number, method, conf))
+    """
+    if resume and os.path.exists(checkpoint_file):
+        # Pages that timed out or failed, likely in the crash being recovered from, are scanned again
+        page_results = {page_num: result for page_num, result in read_checkpoint(checkpoint_file, settings).items()
+                        if result[1] not in (METHOD_TIMEOUT, METHOD_FAILED)}
+        print(f"Resuming from {checkpoint_file}: {len(page_results)} pages already done")
+        return open(checkpoint_file, 'a', encoding='utf-8'), page_results
+
+    checkpoint = open(checkpoint_file, 'w', encoding='utf-8')
+    checkpoint.write(json.dumps({"settings": settings}) + "\n")
+    checkpoint.flush()
+    return checkpoint, {}
+
+def read_checkpoint(checkpoint_file, settings):
+    """
+    Reads the scanned pages from a checkpoint file.
+
+    :param checkpoint_file: Path to the checkpoint file
+    :param settings: Dict of the scan settings, must match those of the checkpoint
+    :return: Dict of page_num -> (doc_number, method, conf)
+    """
+    page_results = {}
+    with open(checkpoint_file, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # A line cut short by a crash, that page is simply scanned again
+            if "settings" in record:
+                if record["settings"] != settings:
+                    raise ValueError(f"Checkpoint {checkpoint_file} was made with settings {record['settings']}, "
+                                     f"not {settings}. Remove it or run without --resume.")
+            else:
+                page_results[record["page"]] = (record["doc"], record["method"], record["conf"])
+    return page_results
+
+def write_checkpoint(checkpoint, page_num, doc_number, method, conf):
+    """
+    Appends a scanned page to the checkpoint and flushes it to disk.
+    """
+    checkpoint.write(json.dumps({"page": page_num, "doc": doc_number, "method": method, "conf": conf}) + "\n")
+    checkpoint.flush()
+
+def full_scan(pool, total_pages, checkpoint, page_results):
+    """
+    Scans every page of the PDF that is not in page_results yet for its document number.
+
+    :param pool: PageWorkerPool scanning the pages
+    :param total_pages: Number of pages in the PDF
+    :param checkpoint: Checkpoint file object every scanned page is appended to
+    :param page_results: Dict of page_num -> (doc_number, method, conf) of the pages already done
+    """
+    start_time = time.time()
+    page_nums = [page_num for page_num in range(1, total_pages + 1) if page_num not in page_results]
+    for done, (page_num, doc_number, method, conf) in enumerate(pool.imap(page_nums), start=1):
+        # Time estimation, based on the pages finished so far by all workers together
+        elapsed_time = time.time() - start_time
+        pages_per_second = done / elapsed_time if elapsed_time > 0 else 0
+        remaining_time = (len(page_nums) - done) / pages_per_second if pages_per_second > 0 else 0
+        print(f"Processing page {page_num}/{total_pages}: document number is "
+              f"{f'{doc_number} ({method})' if doc_number else 'not found'} "
+              f"| {pages_per_second:.2f} pages/s | Estimated remaining time: {remaining_time:.0f} seconds")
+        write_checkpoint(checkpoint, page_num, doc_number, method, conf)
+        page_results[page_num] = (doc_number, method, conf)
+
+def sparse_scan(pool, total_pages, checkpoint, page_results, step=SPARSE_STEP):
+    """
+    Scans a sample of pages and bisects only between samples whose document numbers differ.
+
+    Every step-th page (and the last page) is scanned first. Each following round scans the
+    middle page of every gap between two scanned pages with a different document number, or
+    where either end has no number (unresolved, blank, redacted, failed or timed out), as a
+    whole document can hide between two such pages. It stops when every gap left lies between two
+    pages with the same number. See infer_gaps for the pages that are not scanned.
+
+    :param pool: PageWorkerPool scanning the pages
+    :param total_pages: Number of pages in the PDF
+    :param checkpoint: Checkpoint file object every scanned page is appended to
+    :param page_results: Dict of page_num -> (doc_number, method, conf) of the pages already done
+    :param step: Distance between the sampled pages of the first round
+    """
+    pending = sorted(set(range(1, total_pages + 1, step)) | {total_pages})
+    scan_round = 0
+    while pending:
+        scan_round += 1
+        pending = [page_num for page_num in pending if page_num not in page_results]
+        for page_num, doc_number, method, conf in pool.imap(pending):
+            print(f"Processing page {page_num}/{total_pages} (round {scan_round}): document number is "
+                  f"{f'{doc_number} ({method})' if doc_number else 'not found'}")
+            write_checkpoint(checkpoint, page_num, doc_number, method, conf)
+            page_results[page_num] = (doc_number, method, conf)
+
+        # Bisect every gap in which the document number changes or is not known at either end
+        scanned = sorted(page_results)
+        pending = [(a + b) // 2 for a, b in zip(scanned, scanned[1:])
+                   if b - a > 1 and (page_results[a][0] is None or page_results[a][0] != page_results[b][0])]
+
+    scanned_pages = len(page_results)
+    print(f"Sparse scan: {scanned_pages} of {total_pages} pages scanned in {scan_round} rounds, "
+          f"{total_pages - scanned_pages} page scans saved "
+          f"({(total_pages - scanned_pages) / total_pages * 100 if total_pages else 0:.0f}%).")
+
+def infer_gaps(page_results):
+    """
+    Attributes the pages between two scanned pages with the same document number to that number.
+    Gaps next to a page without a number are never inferred, sparse_scan scans those completely.
+
+    This assumes embedded documents are contiguous runs of pages, so a page between two pages of
+    the same document belongs to it as well, even a blank or unreadable one.
+
+    :param page_results: Dict of page_num -> (doc_number, method, conf) of the scanned pages, updated in place
+    """
+    scanned = sorted(page_results)
+    for a, b in zip(scanned, scanned[1:]):
+        if page_results[a][0] is not None and page_results[a][0] == page_results[b][0]:
+            for page_num in range(a + 1, b):
+                page_results[page_num] = (page_results[a][0], METHOD_INFERRED, None)
+
+def process_pdf(input_pdf, corner, workers=1, dpi=RENDER_DPI, scan="full", step=SPARSE_STEP, resume=False,
+                page_timeout=PAGE_TIMEOUT):
     """
     Processes a PDF file, OCRs every page, and records document numbers with their page numbers.
 
+    Every scanned page is appended to <input_pdf>_document_numbers.checkpoint.jsonl as soon as it is
+    done, and the output file is derived from that checkpoint, so an interrupted scan can be resumed.
+
     :param input_pdf: Path to the PDF file
-    :param corner: The corner where document numbers are expected to be found
+    :param corner: The corner where document numbers are expected to be found, RED_BOX, or AUTO to detect it
+    :param workers: Number of worker processes to spread the pages over
+    :param dpi: Resolution at which the corner areas are rendered
+    :param scan: "full" to scan every page, "sparse" to only scan pages around document number changes
+    :param step: Distance between the sampled pages of a sparse scan
+    :param resume: Skip the pages already in the checkpoint of an earlier run
+    :param page_timeout: Seconds a single page may take before it is given up as unresolved, 0 for no limit
     :return: None, writes information to a text file
     """
-    global start_time
     start_time = time.time()
     
-    doc = fitz.open(input_pdf)
-    total_pages = len(doc)
+    with fitz.open(input_pdf) as doc:
+        total_pages = len(doc)
     
-    print(f"Starting OCR on '{input_pdf}', total pages: {total_pages}")
+    if corner == AUTO:
+        corner, confidence = detect_corner(input_pdf, total_pages, dpi, workers=workers, page_timeout=page_timeout)
+        print(f"Auto corner: using {corner}, confidence {confidence:.0%}")
+        if confidence < AUTO_MIN_CONFIDENCE:
+            print(f"Warning: low confidence in the detected corner of '{input_pdf}', check the results.")
+
+    print(f"Starting OCR on '{input_pdf}', total pages: {total_pages}, corner: {corner}, workers: {workers}, scan: {scan}")
     
     output_file = f"{input_pdf.split('.')[0]}_document_numbers.txt"
-    
+    checkpoint_file = f"{input_pdf.split('.')[0]}_document_numbers.checkpoint.jsonl"
+    settings = {"corner": corner, "dpi": dpi, "pages": total_pages}
+
+    checkpoint, page_results = open_checkpoint(checkpoint_file, settings, resume)
+    with checkpoint, PageWorkerPool(input_pdf, corner, dpi, workers, page_timeout) as pool:
+        if scan == "sparse":
+            sparse_scan(pool, total_pages, checkpoint, page_results, step)
+        else:
+            full_scan(pool, total_pages, checkpoint, page_results)
+
+    page_results = read_checkpoint(checkpoint_file, settings)
+    if scan == "sparse":
+        infer_gaps(page_results)
+
     with open(output_file, 'w', encoding='utf-8') as file:
         doc_numbers = {}
-        with Timeout(3600):  # 3600 seconds timeout
-            for page_num, page in enumerate(doc, start=1):
-                doc_number = extract_document_number(page, page_num, total_pages, corner)
-                if doc_number:
-                    if doc_number in doc_numbers:
-                        doc_numbers[doc_number].append(page_num)
-                    else:
-                        doc_numbers[doc_number] = [page_num]
+        methods = Counter()
+        for page_num in sorted(page_results):
+            doc_number, method, conf = page_results[page_num]
+            methods[method] += 1
+            if doc_number:
+                if doc_number in doc_numbers:
+                    doc_numbers[doc_number].append(page_num)
+                else:
+                    doc_numbers[doc_number] = [page_num]
         
         for doc_number, pages in doc_numbers.items():
             file.write(f"{os.path.basename(input_pdf)} {doc_number} {pages_to_ranges(pages)}\n")
     
     total_time = time.time() - start_time
-    print(f"Finished processing. Time taken: {total_time:.2f} seconds.")
+    print(f"Finished processing. Time taken: {total_time:.2f} seconds "
+          f"({total_pages / total_time if total_time > 0 else 0:.2f} pages/s).")
+    print(f"Pages resolved from the text layer: {methods[METHOD_TEXT]}, by OCR: {methods[METHOD_OCR]}, "
+          f"by the red box: {methods[METHOD_RED_BOX]}, inferred: {methods[METHOD_INFERRED]}, not found: {methods[None]}, "
+          f"timed out: {methods[METHOD_TIMEOUT]}, failed: {methods[METHOD_FAILED]}")
+    print(f"Pages skipped without OCR: blank: {methods[woo_ocr.PAGE_BLANK]}, redacted: {methods[woo_ocr.PAGE_REDACTED]}")
     print(f"Results saved to {output_file}")
 
 # Main execution
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python woo-extract-docnr.py <input_pdf> <corner>")
-        print("Example corners: 'top-left', 'top-right', 'bottom-left', 'bottom-right'")
-        print("Output <input_pdf>.txt in which is listed the docnr and page range. Input for woo-extract.py.")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(
+        description="OCR the document number in a corner of every page of <input_pdf>.",
+        epilog="Output <input_pdf>_document_numbers.txt in which is listed the docnr and page range. Input for woo-extract.py.")
+    parser.add_argument('input_pdf', help="PDF file to analyse.")
+    parser.add_argument('corner', choices=CORNERS + [RED_BOX, AUTO],
+                        help="Corner where the document number is located, 'red-box' to only look for a red box "
+                             "in the top-right, or 'auto' to detect it from a sample of pages.")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of worker processes OCR'ing pages in parallel (default: 1).")
+    parser.add_argument('--dpi', type=int, default=RENDER_DPI,
+                        help=f"Resolution at which the corner is rendered for OCR (default: {RENDER_DPI}).")
+    parser.add_argument('--scan', choices=["full", "sparse"], default="full",
+                        help="'full' scans every page, 'sparse' samples pages and only scans densely where "
+                             "the document number changes (default: full).")
+    parser.add_argument('--step', type=int, default=SPARSE_STEP,
+                        help=f"Distance between the sampled pages of a sparse scan (default: {SPARSE_STEP}).")
+    parser.add_argument('--resume', action='store_true',
+                        help="Continue an interrupted scan from its checkpoint file, skipping the pages already done.")
+    parser.add_argument('--page-timeout', type=int, default=PAGE_TIMEOUT,
+                        help=f"Seconds a single page may take before its worker is killed and the page is recorded "
+                             f"as unresolved, 0 for no limit (default: {PAGE_TIMEOUT}).")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Don't use the shared OCR result cache (see woo_ocr.py --cache-stats).")
+    parser.add_argument('--large-file', action='store_true',
+                        help="Keep memory use flat on multi-GB PDFs by releasing decoded pages as soon as they are scanned.")
+    parser.add_argument('--max-memory', type=int, default=0, metavar='MB',
+                        help="Hard memory ceiling per process in MB, implies --large-file (default: none).")
+    args = parser.parse_args()
 
-    input_pdf, corner = sys.argv[1], sys.argv[2]
-    if corner not in ["top-left", "top-right", "bottom-left", "bottom-right"]:
-        print("Invalid corner specified.")
-        sys.exit(1)
+    if args.workers < 1:
+        parser.error("--workers must be at least 1.")
+    if args.step < 1:
+        parser.error("--step must be at least 1.")
+    if args.page_timeout < 0:
+        parser.error("--page-timeout can't be negative.")
+    if args.no_cache:
+        os.environ["WOO_OCR_CACHE"] = "off"  # Inherited by the page workers
+    if args.large_file or args.max_memory:
+        woo_largefile.enable(args.max_memory)  # Also inherited by the page workers
 
     try:
-        process_pdf(input_pdf, corner)
-    except TimeoutError:
-        print("Script execution has exceeded the time limit. Aborting.")
+        process_pdf(args.input_pdf, args.corner, args.workers, args.dpi, args.scan, args.step, args.resume,
+                    args.page_timeout)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
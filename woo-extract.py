@@ -1,35 +1,45 @@
 import sys
-from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2 import PdfWriter
+import fitz  # PyMuPDF
 import os
 import time
 import glob
+import argparse
+import tempfile
+import multiprocessing
+import hashlib
+import json
+import woo_largefile
+
+ENGINES = ["fitz", "pypdf2"]
+# Records what every output was written from, next to the outputs
+MANIFEST_FILE = "woo-extract.manifest.json"
+
+# Source document and save options of a split worker, set by init_split_worker
+_worker_source = None
+_worker_compact = True
+_worker_recompress = False
 
 def parse_line(line):
     """
     Parse each line from the input file into components needed for splitting.
-    
+
     :param line: A string containing 'pdf_path document_number page_range'
     :return: Tuple of (pdf_path, document_number, page_range)
     """
-    parts = line.strip().split(' ')
+    # woo-extract-docnr.py separates the parts of a page range with ", "
+    parts = line.strip().split(' ', 2)
     if len(parts) != 3:
         raise ValueError(f"Incorrect format in line: {line}")
-    return parts[0], parts[1], parts[2]
+    return parts[0], parts[1], parts[2].replace(' ', '')
 
-def process_pdf(pdf_path, document_number, page_range, reader):
+def parse_page_range(page_range):
     """
-    Extracts specified pages from a PDF and saves them as a new PDF.
+    Parse a page range like '1-3,7' into a sorted list of page numbers without duplicates.
 
-    :param pdf_path: Path to the input PDF
-    :param document_number: The number to use in the output filename
     :param page_range: String describing the pages to extract
-    :param reader: The PdfReader object for the PDF
-    :return: None, saves a new PDF file
+    :return: List of 1-based page numbers
     """
-    total_pages = len(reader.pages)
-    writer = PdfWriter()
-
-    # Parse page range
     pages = []
     for part in page_range.split(','):
         if '-' in part:
@@ -37,65 +47,526 @@ def process_pdf(pdf_path, document_number, page_range, reader):
             pages.extend(range(a, b + 1))
         else:
             pages.append(int(part))
-    pages = sorted(list(set(pages)))  # Ensure no duplicates and in order
+    return sorted(list(set(pages)))  # Ensure no duplicates and in order
+
+def output_filename(pdf_path, document_number, page_range, output_dir="."):
+    """
+    :return: Path of the PDF a document is extracted to
+    """
+    base_name = os.path.basename(pdf_path).split('.')[0]  # Strip path information
+    return os.path.join(output_dir, f"{document_number} p{page_range.replace(',', '_')} __ {base_name}.pdf")
+
+def process_pdf(pdf_path, document_number, page_range, reader, output_dir="."):
+    """
+    Extracts specified pages from a PDF and saves them as a new PDF, using PyPDF2.
+
+    :param pdf_path: Path to the input PDF
+    :param document_number: The number to use in the output filename
+    :param page_range: String describing the pages to extract
+    :param reader: The PdfReader object for the PDF
+    :param output_dir: Directory the new PDF is saved in
+    :return: Tuple of (output file, number of pages written)
+    """
+    total_pages = len(reader.pages)
+    writer = PdfWriter()
+
+    pages = parse_page_range(page_range)
 
     print(f"Extracting pages {page_range} from {os.path.basename(pdf_path)}")
 
+    written = 0
     for i, page in enumerate(pages, 1):
         if page <= total_pages:
             writer.add_page(reader.pages[page - 1])  # PyPDF2 uses 0-indexing
+            written += 1
             # print(f"Extracted page {page}")
 
     # Create output filename
-    base_name = os.path.basename(pdf_path).split('.')[0]  # Strip path information
-    output_file = f"{document_number} p{page_range.replace(',', '_')} __ {base_name}.pdf"
-    
+    output_file = output_filename(pdf_path, document_number, page_range, output_dir)
+
     with open(output_file, "wb") as output_stream:
         writer.write(output_stream)
-    
+
     print(f"New PDF saved as: {output_file}")
+    return output_file, written
 
-def split_pdfs_from_file(instructions_file_pattern):
+def init_split_worker(pdf_path, compact=True, recompress=False):
+    """
+    Opens the source PDF once for all the documents a split worker extracts from it.
+
+    :param pdf_path: Path to the input PDF
+    :param compact: Prune unused resources and deduplicate identical objects in every output
+    :param recompress: Recompress all streams, including images and fonts, in every output
+    """
+    global _worker_source, _worker_compact, _worker_recompress
+    _worker_source = fitz.open(pdf_path)
+    _worker_compact = compact
+    _worker_recompress = recompress
+
+def write_split(job):
+    """
+    Extracts the pages of one document from the source opened by init_split_worker, using PyMuPDF.
+
+    :param job: Tuple of (pdf_path, document_number, page_range, output_dir)
+    :return: Tuple of (job, output file, number of pages written, seconds taken, error message or None)
+    """
+    pdf_path, document_number, page_range, output_dir = job
+    start_time = time.time()
+    try:
+        pages = [page for page in parse_page_range(page_range) if page <= len(_worker_source)]
+        output_file = output_filename(pdf_path, document_number, page_range, output_dir)
+        with fitz.open() as writer:
+            # Copy consecutive pages in one go. final=False keeps the map of objects already copied
+            # until the last run, so resources shared by the runs are only written once
+            run_start = None
+            for i, page in enumerate(pages):
+                if run_start is None:
+                    run_start = page
+                last = i + 1 == len(pages)
+                if last or pages[i + 1] != page + 1:
+                    writer.insert_pdf(_worker_source, from_page=run_start - 1, to_page=page - 1, final=last)
+                    run_start = None
+            if _worker_compact:
+                # Pages that point at a whole-document resource dictionary would otherwise drag
+                # every font and image of the source along
+                for writer_page in writer:
+                    writer_page.clean_contents(sanitize=True)
+            # garbage=4 drops unused objects and merges identical ones, streams included.
+            # clean_contents leaves the rewritten content streams uncompressed; deflate only
+            # compresses streams that are not compressed yet, so it is on whenever compacting
+            writer.save(output_file, garbage=4 if _worker_compact else 0, deflate=_worker_compact or _worker_recompress,
+                        deflate_images=_worker_recompress, deflate_fonts=_worker_recompress)
+        woo_largefile.release_page_cache()
+        return job, output_file, len(pages), time.time() - start_time, None
+    except Exception as e:
+        return job, None, 0, time.time() - start_time, str(e)
+
+def read_instructions(instructions_file):
+    """
+    Reads a file of split instructions, grouped by source PDF.
+
+    :param instructions_file: Path to the file containing split instructions
+    :return: Tuple of (dict of pdf_path -> list of (document_number, page_range), number of bad lines)
+    """
+    sources = {}
+    failures = 0
+    with open(instructions_file, 'r') as file:
+        for line in file:
+            if not line.strip():
+                continue
+            try:
+                pdf_path, document_number, page_range = parse_line(line)
+                parse_page_range(page_range)
+                sources.setdefault(pdf_path, []).append((document_number, page_range))
+            except ValueError as e:
+                print(f"Error processing line '{line.strip()}' from {instructions_file}: {str(e)}")
+                failures += 1
+    return sources, failures
+
+def split_source(pdf_path, documents, workers=1, output_dir=".", compact=True, recompress=False):
+    """
+    Extracts all documents from one source PDF with PyMuPDF. The source is parsed once (per
+    worker) and the outputs are written by a pool of worker processes.
+
+    :param pdf_path: Path to the input PDF
+    :param documents: List of (document_number, page_range)
+    :param workers: Number of worker processes writing outputs concurrently
+    :param output_dir: Directory the new PDFs are saved in
+    :param compact: Prune unused resources and deduplicate identical objects in every output
+    :param recompress: Recompress all streams, including images and fonts, in every output
+    :return: List of (output file or None, pages written, error message or None)
+    """
+    jobs = [(pdf_path, document_number, page_range, output_dir) for document_number, page_range in documents]
+    if workers > 1 and len(jobs) > 1:
+        # Open the source here first: a pool whose initializer raises keeps starting new workers
+        # forever, rather than failing like the serial run
+        with fitz.open(pdf_path):
+            pass
+        pool = multiprocessing.Pool(min(workers, len(jobs)), initializer=init_split_worker,
+                                    initargs=(pdf_path, compact, recompress))
+        results = pool.imap(write_split, jobs)
+    else:
+        pool = None
+        init_split_worker(pdf_path, compact, recompress)
+        results = map(write_split, jobs)
+
+    outcomes = []
+    try:
+        for (_, document_number, page_range, _), output_file, written, seconds, error in results:
+            if error:
+                print(f"Error extracting pages {page_range} of {document_number} from {os.path.basename(pdf_path)}: {error}")
+            else:
+                print(f"Extracted pages {page_range} from {os.path.basename(pdf_path)}")
+                print(f"New PDF saved as: {output_file}")
+                print(f"Time taken for this operation: {seconds:.2f} seconds.")
+            print("-" * 50)  # Visual separator for each operation
+            outcomes.append((output_file, written, error))
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+        else:
+            _worker_source.close()
+    return outcomes
+
+def split_source_pypdf2(pdf_path, documents, output_dir="."):
+    """
+    Extracts all documents from one source PDF with PyPDF2, one document after the other.
+
+    :param pdf_path: Path to the input PDF
+    :param documents: List of (document_number, page_range)
+    :param output_dir: Directory the new PDFs are saved in
+    :return: List of (output file or None, pages written, error message or None)
+    """
+    outcomes = []
+    reader = woo_largefile.open_pdf_reader(pdf_path)
+    try:
+        for document_number, page_range in documents:
+            try:
+                start_time = time.time()
+                output_file, written = process_pdf(pdf_path, document_number, page_range, reader, output_dir)
+                end_time = time.time()
+                print(f"Time taken for this operation: {end_time - start_time:.2f} seconds.")
+                outcomes.append((output_file, written, None))
+            except Exception as e:
+                print(f"Error extracting pages {page_range} of {document_number} from {os.path.basename(pdf_path)}: {str(e)}")
+                outcomes.append((None, 0, str(e)))
+            # The document is written, the objects parsed for it are not needed anymore
+            woo_largefile.release_reader(reader)
+            print("-" * 50)  # Visual separator for each operation
+    finally:
+        reader.stream.close()
+    return outcomes
+
+def file_sha256(path):
+    """
+    :return: Hex SHA-256 of the file contents, read in chunks
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_manifest(output_dir="."):
+    """
+    Loads the manifest of the outputs written to output_dir by earlier runs.
+
+    :return: Dict of output file name -> dict with source, source_sha256, source_size, source_mtime,
+             page_range, settings, output_sha256, output_size and output_mtime
+    """
+    manifest_file = os.path.join(output_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_file):
+        return {}
+    try:
+        with open(manifest_file, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError) as e:
+        print(f"Error reading {manifest_file}, all outputs will be rewritten: {str(e)}")
+        return {}
+
+def save_manifest(manifest, output_dir="."):
+    manifest_file = os.path.join(output_dir, MANIFEST_FILE)
+    with open(manifest_file + ".tmp", 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=1, sort_keys=True)
+    os.replace(manifest_file + ".tmp", manifest_file)
+
+def manifest_entry(pdf_path, source_sha256, page_range, settings, output_file):
+    stat = os.stat(output_file)
+    source_stat = os.stat(pdf_path)
+    return {"source": pdf_path, "source_sha256": source_sha256, "source_size": source_stat.st_size,
+            "source_mtime": source_stat.st_mtime_ns, "page_range": page_range, "settings": settings,
+            "output_sha256": file_sha256(output_file), "output_size": stat.st_size, "output_mtime": stat.st_mtime_ns}
+
+def cached_source_sha256(pdf_path, previous):
+    """
+    Hash of a source PDF, taken from the manifest when the size and modification time of the
+    source are still those recorded there, so unchanged multi-GB sources are not read again.
+
+    :param previous: Dict of output file name -> manifest entry of the earlier runs, for the outputs of this source
+    :return: Hex SHA-256 of the source
+    """
+    stat = os.stat(pdf_path)
+    for entry in previous.values():
+        if (entry.get("source_size"), entry.get("source_mtime")) == (stat.st_size, stat.st_mtime_ns):
+            return entry["source_sha256"]
+    return file_sha256(pdf_path)
+
+def is_up_to_date(entry, source_sha256, page_range, settings, output_file):
+    """
+    Checks whether an output recorded in the manifest was written from the same source, range and
+    settings, and is still unchanged on disk. The output is only hashed when its size or
+    modification time differ from the manifest.
+    """
+    if not entry or not os.path.exists(output_file):
+        return False
+    if (entry["source_sha256"], entry["page_range"], entry["settings"]) != (source_sha256, page_range, settings):
+        return False
+    stat = os.stat(output_file)
+    if (stat.st_size, stat.st_mtime_ns) == (entry["output_size"], entry["output_mtime"]):
+        return True
+    return file_sha256(output_file) == entry["output_sha256"]
+
+def split_settings(engine="fitz", compact=True, recompress=False):
+    """
+    :return: The settings recorded in the manifest, only those that change the output of the engine
+    """
+    if engine == "pypdf2":
+        return {"engine": engine}
+    return {"engine": engine, "compact": compact, "recompress": recompress}
+
+def split_documents(pdf_path, documents, previous, engine="fitz", workers=1, output_dir=".", compact=True,
+                    recompress=False, incremental=True):
+    """
+    Writes the documents of one source PDF that are not up to date according to the manifest.
+
+    :param pdf_path: Path to the input PDF
+    :param documents: List of (document_number, page_range)
+    :param previous: Dict of output file name -> manifest entry of the earlier runs, for the outputs of this source
+    :param incremental: Skip the outputs the manifest shows to be up to date
+    :return: Tuple of (dict with the totals of outputs, pages, bytes, skipped and failures,
+             dict of output file name -> new manifest entry, or None to drop the entry)
+    """
+    totals = {"outputs": 0, "pages": 0, "bytes": 0, "skipped": 0, "failures": 0}
+    updates = {}
+    settings = split_settings(engine, compact, recompress)
+    try:
+        source_sha256 = cached_source_sha256(pdf_path, previous) if incremental else file_sha256(pdf_path)
+        source_stat = os.stat(pdf_path)
+        to_write = []
+        for document_number, page_range in documents:
+            output_file = output_filename(pdf_path, document_number, page_range, output_dir)
+            name = os.path.basename(output_file)
+            if incremental and is_up_to_date(previous.get(name), source_sha256, page_range, settings, output_file):
+                totals["skipped"] += 1
+                # Record the current size and mtime of the source, so the next run can reuse its hash
+                updates[name] = dict(previous[name], source_size=source_stat.st_size,
+                                     source_mtime=source_stat.st_mtime_ns)
+            else:
+                to_write.append((document_number, page_range))
+        print(f"{os.path.basename(pdf_path)}: {len(to_write)} of {len(documents)} documents to write, "
+              f"{len(documents) - len(to_write)} up to date")
+        if not to_write:
+            return totals, updates
+
+        if engine == "pypdf2":
+            outcomes = split_source_pypdf2(pdf_path, to_write, output_dir)
+        else:
+            outcomes = split_source(pdf_path, to_write, workers, output_dir, compact, recompress)
+    except MemoryError:
+        print(f"Error processing {pdf_path}: out of memory, use --large-file or raise --max-memory")
+        totals["failures"] += len(documents) - totals["skipped"]
+        return totals, updates
+    except Exception as e:
+        print(f"Error processing {pdf_path}: {str(e)}")
+        totals["failures"] += len(documents) - totals["skipped"]
+        return totals, updates
+
+    for (document_number, page_range), (output_file, written, error) in zip(to_write, outcomes):
+        if error:
+            totals["failures"] += 1
+            updates[os.path.basename(output_filename(pdf_path, document_number, page_range, output_dir))] = None
+        else:
+            totals["outputs"] += 1
+            totals["pages"] += written
+            totals["bytes"] += os.path.getsize(output_file)
+            updates[os.path.basename(output_file)] = manifest_entry(pdf_path, source_sha256, page_range, settings, output_file)
+    return totals, updates
+
+class PrefixedOutput:
+    """
+    Stream that writes every line with a prefix to the underlying stream, so the output of
+    concurrent job workers can be told apart.
+    """
+    def __init__(self, stream, prefix):
+        self.stream = stream
+        self.prefix = prefix
+        self.buffer = ""
+
+    def write(self, text):
+        self.buffer += text
+        *lines, self.buffer = self.buffer.split("\n")
+        if lines:
+            self.stream.write("".join(f"{self.prefix}{line}\n" for line in lines))
+            self.stream.flush()
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+def init_job_worker():
+    sys.stdout = PrefixedOutput(sys.stdout, f"[{multiprocessing.current_process().name}] ")
+
+def split_documents_job(job):
+    """
+    Runs split_documents for one source in a job worker.
+
+    :param job: Tuple of (pdf_path, documents, previous, options), options being the keyword arguments of split_documents
+    :return: Tuple of (pdf_path, totals, manifest updates)
+    """
+    pdf_path, documents, previous, options = job
+    totals, updates = split_documents(pdf_path, documents, previous, **options)
+    sys.stdout.flush()
+    return pdf_path, totals, updates
+
+def split_pdfs_from_file(instructions_file_pattern, engine="fitz", workers=1, output_dir=".", compact=True, recompress=False,
+                         incremental=True, clean=False, jobs=1):
     """
     Process files containing lines of PDF split instructions, allowing wildcard patterns.
-    
+
+    The instructions of all files are grouped by source PDF. With jobs > 1 the sources are spread
+    over a pool of job worker processes, each splitting whole sources; the documents of a source
+    are then written by the job worker itself.
+
+    A manifest in output_dir records the source hash, page range, settings and output hash of
+    every output, so a rerun only writes the outputs whose source or range changed. Outputs in the
+    manifest that come from one of the sources of this run but are no longer in its instructions
+    are reported as stale, and removed with clean.
+
     :param instructions_file_pattern: Path pattern to the file(s) containing split instructions
+    :param engine: "fitz" to write all documents of a source in one pass, "pypdf2" for one PdfWriter per line
+    :param workers: Number of worker processes writing outputs of a source concurrently (fitz engine, jobs=1 only)
+    :param output_dir: Directory the new PDFs are saved in
+    :param compact: Prune unused resources and deduplicate identical objects in every output (fitz engine only)
+    :param recompress: Recompress all streams, including images and fonts, in every output (fitz engine only)
+    :param incremental: Skip the outputs the manifest shows to be up to date
+    :param clean: Remove stale outputs
+    :param jobs: Number of job worker processes splitting sources concurrently
+    :return: Dict with the totals of sources, outputs, pages, bytes written, skipped, stale, failures and seconds taken
     """
+    totals = {"sources": 0, "outputs": 0, "pages": 0, "bytes": 0, "skipped": 0, "stale": 0, "failures": 0}
+    start_time = time.time()
+    manifest = load_manifest(output_dir)
+
+    sources = {}
     for instructions_file in glob.glob(instructions_file_pattern):
-        current_pdf = None
-        reader = None
-
-        with open(instructions_file, 'r') as file:
-            for line in file:
-                try:
-                    pdf_path, document_number, page_range = parse_line(line)
-                    
-                    if current_pdf != pdf_path:
-                        if reader:
-                            reader.stream.close()  # Close the previous PDF's stream
-                        reader = PdfReader(pdf_path)
-                        current_pdf = pdf_path
-                    
-                    start_time = time.time()
-                    process_pdf(pdf_path, document_number, page_range, reader)
-                    end_time = time.time()
-                    print(f"Time taken for this operation: {end_time - start_time:.2f} seconds.")
-                    print("-" * 50)  # Visual separator for each operation
-
-                except Exception as e:
-                    print(f"Error processing line '{line.strip()}' from {instructions_file}: {str(e)}")
-                    continue
-
-        if reader:
-            reader.stream.close()  # Ensure the last opened PDF is closed
+        file_sources, failures = read_instructions(instructions_file)
+        totals["failures"] += failures
+        for pdf_path, documents in file_sources.items():
+            sources.setdefault(pdf_path, []).extend(documents)
+
+    current_outputs = set()
+    split_jobs = []
+    for pdf_path, documents in sources.items():
+        names = [os.path.basename(output_filename(pdf_path, document_number, page_range, output_dir))
+                 for document_number, page_range in documents]
+        current_outputs.update(names)
+        previous = {name: manifest[name] for name in names if name in manifest}
+        options = {"engine": engine, "workers": workers if jobs <= 1 else 1, "output_dir": output_dir,
+                   "compact": compact, "recompress": recompress, "incremental": incremental}
+        split_jobs.append((pdf_path, documents, previous, options))
+    # Largest sources first, so a big one doesn't start last and keep one job worker busy on its own
+    split_jobs.sort(key=lambda job: len(job[1]), reverse=True)
+
+    if jobs > 1 and len(split_jobs) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(split_jobs)), initializer=init_job_worker)
+        results = pool.imap_unordered(split_documents_job, split_jobs)
+    else:
+        pool = None
+        results = map(split_documents_job, split_jobs)
+
+    try:
+        for pdf_path, source_totals, updates in results:
+            totals["sources"] += 1
+            for key, value in source_totals.items():
+                totals[key] += value
+            for name, entry in updates.items():
+                if entry is None:
+                    manifest.pop(name, None)
+                else:
+                    manifest[name] = entry
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    # Outputs of this run's sources that no instruction line asks for anymore
+    for name, entry in sorted(manifest.items()):
+        if entry["source"] in sources and name not in current_outputs:
+            totals["stale"] += 1
+            output_file = os.path.join(output_dir, name)
+            if clean:
+                if os.path.exists(output_file):
+                    os.remove(output_file)
+                del manifest[name]
+                print(f"Removed stale output: {output_file}")
+            else:
+                print(f"Stale output (no longer in the instructions, use --clean to remove): {output_file}")
+
+    save_manifest(manifest, output_dir)
+    totals["seconds"] = time.time() - start_time
+    return totals
+
+def benchmark(instructions_file_pattern, workers=1, recompress=False):
+    """
+    Splits the same instructions with both engines, and with and without compaction, into temporary
+    directories and compares pages per second and total output size.
+
+    :param instructions_file_pattern: Path pattern to the file(s) containing split instructions
+    :param workers: Number of worker processes for the fitz engine
+    :param recompress: Recompress all streams in the compacted fitz run
+    """
+    runs = {
+        "pypdf2": ("pypdf2", False, False),
+        "fitz": ("fitz", False, False),
+        "fitz compacted": ("fitz", True, recompress),
+    }
+    results = {}
+    for name, (engine, compact, recompress_streams) in runs.items():
+        with tempfile.TemporaryDirectory() as output_dir:
+            results[name] = split_pdfs_from_file(instructions_file_pattern, engine, workers, output_dir,
+                                                 compact, recompress_streams, incremental=False)
+
+    print("Benchmark:")
+    for name, totals in results.items():
+        pages_per_second = totals["pages"] / totals["seconds"] if totals["seconds"] > 0 else 0
+        print(f"  {name:14} {totals['outputs']} outputs, {totals['pages']} pages in {totals['seconds']:.2f} seconds "
+              f"({pages_per_second:.1f} pages/s), {totals['bytes'] / 1024 / 1024:.1f} MB written, "
+              f"{totals['failures']} failures")
 
 # Main execution
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python woo-extract.py <instructions_file_pattern>")
-        print("Input file has per line <pdf_name> <document_id> <page_range>.")
-        print("Output will be extracted pdf's per <document_id>.")
-        sys.exit(1)
-
-    instructions_file_pattern = sys.argv[1]
-    split_pdfs_from_file(instructions_file_pattern)
+    parser = argparse.ArgumentParser(
+        description="Input file has per line <pdf_name> <document_id> <page_range>.",
+        epilog="Output will be extracted pdf's per <document_id>.")
+    parser.add_argument('instructions_file_pattern', help="Instructions file(s), wildcards allowed.")
+    parser.add_argument('--engine', choices=ENGINES, default="fitz",
+                        help="'fitz' parses each source once and writes all its documents in one pass, "
+                             "'pypdf2' writes one document after the other (default: fitz).")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of worker processes writing the documents of a source concurrently (default: 1).")
+    parser.add_argument('--jobs', type=int, default=1,
+                        help="Number of worker processes splitting different source PDFs concurrently (default: 1). "
+                             "With more than one job the documents of a source are written by its job worker.")
+    parser.add_argument('--no-compact', action='store_true',
+                        help="Don't prune unused resources and deduplicate identical objects in the outputs.")
+    parser.add_argument('--recompress', action='store_true',
+                        help="Recompress all streams of the outputs, including images and fonts (slower, smaller).")
+    parser.add_argument('--force', action='store_true',
+                        help="Rewrite all outputs, also those the manifest shows to be up to date.")
+    parser.add_argument('--clean', action='store_true',
+                        help="Remove stale outputs: documents of the processed sources that are no longer in the instructions.")
+    parser.add_argument('--large-file', action='store_true',
+                        help="Keep memory use flat on multi-GB source PDFs: memory-map them and release parsed pages after use.")
+    parser.add_argument('--max-memory', type=int, default=0, metavar='MB',
+                        help="Hard memory ceiling per process in MB, implies --large-file (default: none).")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="Split with both engines into temporary directories and compare pages/s and output size.")
+    args = parser.parse_args()
+
+    if args.workers < 1 or args.jobs < 1:
+        parser.error("--workers and --jobs must be at least 1.")
+    if args.large_file or args.max_memory:
+        woo_largefile.enable(args.max_memory)  # Inherited by the worker processes
+
+    if args.benchmark:
+        benchmark(args.instructions_file_pattern, args.workers, args.recompress)
+    else:
+        totals = split_pdfs_from_file(args.instructions_file_pattern, args.engine, args.workers, ".",
+                                      not args.no_compact, args.recompress, not args.force, args.clean, args.jobs)
+        pages_per_second = totals["pages"] / totals["seconds"] if totals["seconds"] > 0 else 0
+        print(f"Finished: {totals['sources']} source PDFs, {totals['outputs']} PDFs with {totals['pages']} pages written "
+              f"in {totals['seconds']:.2f} seconds ({pages_per_second:.1f} pages/s, "
+              f"{totals['bytes'] / 1024 / 1024 / max(totals['seconds'], 0.001):.1f} MB/s), "
+              f"{totals['bytes'] / 1024 / 1024:.1f} MB, {totals['skipped']} up to date, {totals['stale']} stale, "
+              f"{totals['failures']} failures.")
@@ -1,9 +1,11 @@
-import sys
 import os
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
 from PIL import Image
-import pytesseract
+import woo_ocr
+import woo_largefile
 from PyPDF2 import PdfWriter, PdfReader
+from PyPDF2.errors import PdfReadError
+from PyPDF2.generic import ArrayObject, DecodedStreamObject, DictionaryObject, FloatObject, NameObject
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
 from reportlab.pdfbase import pdfmetrics
@@ -12,88 +14,364 @@ from reportlab.lib.utils import ImageReader
 import io
 from pathlib import Path
 import shutil
+import argparse
+import queue
+import threading
+import multiprocessing
+import time
+
+# Number of pages rendered ahead of the page being OCR'd
+RENDER_LOOKAHEAD = 2
+# "graft" adds the OCR'd text as an invisible layer to the original pages, "jpeg" replaces the
+# pages with a JPEG of the rendered page with the text on top
+MODE_GRAFT = "graft"
+MODE_JPEG = "jpeg"
+MODES = [MODE_GRAFT, MODE_JPEG]
+# Name of the form XObject holding the text layer in the resources of a grafted page
+TEXT_LAYER_NAME = "/WooOcrText"
+# Use a lower DPI for conversion, e.g., 150 instead of 300
+DPI = 150
+# Mean word confidence below which a page is OCR'd again at the high DPI, when one is given
+MIN_CONF = 60
+# Characters of text a page needs in its text layer to be copied through instead of OCR'd
+MIN_PAGE_TEXT = 10
 
 def setup_fonts():
     pdfmetrics.registerFont(TTFont('DejaVuSans', 'DejaVuSans.ttf'))
 
-def is_pdf_searchable(pdf_path):
+def classify_pages(pdf_path):
+    # Returns the number of pages and the numbers of the pages without a usable text layer, which
+    # need OCR. A PDF that can't be read is OCR'd in full.
     try:
-        reader = PdfReader(open(pdf_path, "rb"))
-        if len(reader.pages) > 0:
-            page = reader.pages[0]
-            if page.extract_text().strip():
-                return True
-    except PyPDF2.errors.PdfReadError:
+        reader = woo_largefile.open_pdf_reader(pdf_path)
+        ocr_pages = []
+        for page_num, page in enumerate(reader.pages, start=1):
+            if len(page.extract_text().strip()) < MIN_PAGE_TEXT:
+                ocr_pages.append(page_num)
+            woo_largefile.release_reader(reader)
+        return len(reader.pages), ocr_pages
+    except PdfReadError:
         print(f"Error reading {os.path.basename(pdf_path)}. Assuming it's not searchable.")
     except Exception as e:
         print(f"An unexpected error occurred while checking {os.path.basename(pdf_path)}: {e}")
-    return False
+    total_pages = pdfinfo_from_path(pdf_path)["Pages"]
+    return total_pages, list(range(1, total_pages + 1))
 
-def process_single_pdf(pdf_path, target_dir):
-    if is_pdf_searchable(pdf_path):
-        print(f"{os.path.basename(pdf_path)} is already searchable and selectable. Skipping.")
-        return
+def render_pages(pdf_path, dpi, page_nums, lookahead=RENDER_LOOKAHEAD):
+    # Renders the pages one at a time in a background thread, so the next page is rendered while
+    # the current one is OCR'd. The bounded queue keeps at most lookahead rendered pages waiting,
+    # so memory use doesn't grow with the number of pages.
+    pages = queue.Queue(maxsize=lookahead)
+    stop = threading.Event()
 
-    output_path = os.path.join(target_dir, os.path.basename(pdf_path))  # Save with original filename
-    setup_fonts()
+    def put(item):
+        # Gives up when the consumer stopped early, instead of blocking on a full queue forever
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
 
-    # Use a lower DPI for conversion, e.g., 150 instead of 300
-    images = convert_from_path(pdf_path, dpi=150)
-    merger = PdfWriter()
+    def produce():
+        try:
+            for page_num in page_nums:
+                images = convert_from_path(pdf_path, dpi=dpi, first_page=page_num, last_page=page_num, use_cropbox=True)
+                if not put(images[0]):
+                    return
+            put(None)
+        except Exception as e:
+            put(e)
 
-    for idx, img in enumerate(images):
-        print(f"Processing page {idx + 1} of {len(images)}")
-        
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = pages.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+def ocr_page(pdf_path, page_num, img, dpi, mode=MODE_GRAFT, high_dpi=0, min_conf=MIN_CONF):
+    # Returns (payload, page class, DPI of the OCR result kept, escalation), escalation being None,
+    # or whether OCR'ing the page again at high_dpi improved it
+    # Cheap look at the render first, blank and fully redacted pages are not OCR'd
+    page_class = woo_ocr.classify_image(img, dpi)
+    if page_class == woo_ocr.PAGE_CONTENT:
         # OCR with lower resolution image
-        data = pytesseract.image_to_data(img, output_type=pytesseract.Output.DICT)
-        h, w = img.height, img.width
+        data = woo_ocr.get_backend().image_to_data(img, dpi=dpi)
+    else:
+        data = {'text': []}
 
-        # Convert to JPEG with lower quality
-        img_byte_arr = io.BytesIO()
-        img.convert('RGB').save(img_byte_arr, format='JPEG', quality=60)  # Lower quality JPEG
-        img_byte_arr.seek(0)
+    escalation = None
+    if high_dpi > dpi and page_class == woo_ocr.PAGE_CONTENT:
+        conf = woo_ocr.data_to_text(data)[1]
+        # Small print comes out as low-confidence words, or none at all, at the low DPI
+        if conf is None or conf < min_conf:
+            escalation = False
+            high_img = convert_from_path(pdf_path, dpi=high_dpi, first_page=page_num, last_page=page_num, use_cropbox=True)[0]
+            high_data = woo_ocr.get_backend().image_to_data(high_img, dpi=high_dpi)
+            high_conf = woo_ocr.data_to_text(high_data)[1]
+            if high_conf is not None and (conf is None or high_conf > conf):
+                img, data, dpi = high_img, high_data, high_dpi
+                escalation = True
 
-        # Use reportlab to create a PDF from the image
-        packet = io.BytesIO()
-        c = canvas.Canvas(packet, pagesize=(w, h))  # No scaling here since we're using lower DPI
+    if mode == MODE_GRAFT:
+        # Only the word boxes, in pixels of the image, are needed to build the text layer
+        words = [(data['left'][i], data['top'][i], data['width'][i], data['height'][i], word)
+                 for i, word in enumerate(data['text']) if word.strip()]
+        return (words, img.width, img.height), page_class, dpi, escalation
+    return image_page_pdf(img, data), page_class, dpi, escalation
 
-        # Draw the image
-        c.drawImage(ImageReader(img_byte_arr), 0, 0, width=w, height=h)
-        
-        # Set up text overlay
-        c.saveState()
-        c.setFillColorRGB(0, 0, 0, alpha=0.01)  # Almost transparent black for overlay
-        c.setFont("DejaVuSans", 10)  # Adjust font size as per need
-
-        # Draw text based on bounding boxes
-        for i, line in enumerate(data['text']):
-            if line.strip():
-                left = data['left'][i]
-                top = data['top'][i]
-                width = data['width'][i]
-                height = data['height'][i]
-                
-                # Position text
-                c.drawString(left, h - top - height, line)
+def image_page_pdf(img, data):
+    h, w = img.height, img.width
 
-        c.restoreState()
-        c.save()
+    # Convert to JPEG with lower quality
+    img_byte_arr = io.BytesIO()
+    img.convert('RGB').save(img_byte_arr, format='JPEG', quality=60)  # Lower quality JPEG
+    img_byte_arr.seek(0)
+
+    # Use reportlab to create a PDF from the image
+    packet = io.BytesIO()
+    c = canvas.Canvas(packet, pagesize=(w, h))  # No scaling here since we're using lower DPI
+
+    # Draw the image
+    c.drawImage(ImageReader(img_byte_arr), 0, 0, width=w, height=h)
+
+    # Set up text overlay
+    c.saveState()
+    c.setFillColorRGB(0, 0, 0, alpha=0.01)  # Almost transparent black for overlay
+    c.setFont("DejaVuSans", 10)  # Adjust font size as per need
+
+    # Draw text based on bounding boxes
+    for i, line in enumerate(data['text']):
+        if line.strip():
+            left = data['left'][i]
+            top = data['top'][i]
+            width = data['width'][i]
+            height = data['height'][i]
+
+            # Position text
+            c.drawString(left, h - top - height, line)
+
+    c.restoreState()
+    c.save()
+
+    # The one-page PDF is passed as bytes, so it can come back from a worker process
+    return packet.getvalue()
+
+def ocr_pages_serial(pdf_path, page_nums, dpi=DPI, mode=MODE_GRAFT, high_dpi=0, min_conf=MIN_CONF):
+    setup_fonts()
+    worker = multiprocessing.current_process().name
+    for page_num, img in zip(page_nums, render_pages(pdf_path, dpi, page_nums)):
+        start_time = time.time()
+        result = ocr_page(pdf_path, page_num, img, dpi, mode, high_dpi, min_conf)
+        yield (page_num,) + result + (time.time() - start_time, worker)
+
+def init_ocr_worker():
+    # Tesseract's OpenMP threads contend with the other workers; one thread per worker process
+    # scales better. Inherited by the tesseract processes pytesseract starts.
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+    setup_fonts()
+
+def ocr_page_job(job):
+    pdf_path, page_num, dpi, mode, high_dpi, min_conf = job
+    start_time = time.time()
+    img = convert_from_path(pdf_path, dpi=dpi, first_page=page_num, last_page=page_num, use_cropbox=True)[0]
+    result = ocr_page(pdf_path, page_num, img, dpi, mode, high_dpi, min_conf)
+    return (page_num,) + result + (time.time() - start_time, multiprocessing.current_process().name)
+
+def to_user_space(page, u, v):
+    # Maps a point on the page as displayed, in points from its top-left corner, to the user space
+    # of the page, in which its content is drawn. The pages are rendered with
+    # use_cropbox=True, so the image is the crop box, turned by /Rotate.
+    x0, y0, x1, y1 = [float(value) for value in page.cropbox]
+    rotation = page.rotation % 360
+    if rotation == 90:
+        return x0 + v, y0 + u
+    if rotation == 180:
+        return x1 - u, y0 + v
+    if rotation == 270:
+        return x1 - v, y1 - u
+    return x0 + u, y1 - v
+
+def build_text_layer(pages):
+    # Draws the words of all OCR'd pages of a document as invisible text, one overlay page per
+    # (source page, (words, image width, image height)) in pages, in a single reportlab canvas
+    setup_fonts()
+    packet = io.BytesIO()
+    c = canvas.Canvas(packet)
+    for page, (words, img_width, img_height) in pages:
+        x0, y0, x1, y1 = [float(value) for value in page.cropbox]
+        rotation = page.rotation % 360
+        displayed_width = x1 - x0 if rotation in (0, 180) else y1 - y0
+        scale = displayed_width / img_width  # Points per pixel
+        c.setPageSize((x1, y1))
+        for left, top, width, height, word in words:
+            size = height * scale
+            text_width = c.stringWidth(word, "DejaVuSans", size)
+            if size <= 0 or text_width <= 0:
+                continue
+            # Baseline at the bottom of the box, less the part of the font below the baseline
+            baseline = top * scale + size + pdfmetrics.getDescent("DejaVuSans", size)
+            c.saveState()
+            c.translate(*to_user_space(page, left * scale, baseline))
+            c.rotate(rotation)  # Upright on the page as it is displayed
+            text = c.beginText(0, 0)
+            text.setTextRenderMode(3)  # Invisible
+            text.setFont("DejaVuSans", size)
+            text.setHorizScale(100 * width * scale / text_width)  # As wide as the word box
+            text.textOut(word)
+            c.drawText(text)
+            c.restoreState()
+        c.showPage()
+    c.save()
+    packet.seek(0)
+    return PdfReader(packet)
+
+def graft_text_layer(writer, page, layer_page):
+    # Adds a text layer page to a page of writer as a form XObject drawn after the original
+    # content. The original content streams and resources are kept as they are: the form has its
+    # own resources, and the original content is only wrapped in q/Q by separate streams.
+    form = DecodedStreamObject()
+    form.set_data(layer_page.get_contents().get_data())
+    # get_data() returns the layer decoded; compress it again (flate_encode drops the other keys,
+    # so they are set afterwards)
+    form = form.flate_encode()
+    form.update({
+        NameObject("/Type"): NameObject("/XObject"),
+        NameObject("/Subtype"): NameObject("/Form"),
+        NameObject("/BBox"): ArrayObject([FloatObject(value) for value in page.cropbox]),
+        NameObject("/Resources"): layer_page["/Resources"].clone(writer),
+    })
+    form_ref = writer._add_object(form)
+
+    # Resources are often shared between pages, change a copy
+    resources = DictionaryObject(page["/Resources"].get_object()) if "/Resources" in page else DictionaryObject()
+    xobjects = DictionaryObject(resources["/XObject"].get_object()) if "/XObject" in resources else DictionaryObject()
+    name = TEXT_LAYER_NAME
+    while name in xobjects:
+        name += "_"
+    xobjects[NameObject(name)] = form_ref
+    resources[NameObject("/XObject")] = xobjects
+    page[NameObject("/Resources")] = resources
+
+    contents = ArrayObject()
+    if "/Contents" in page:
+        original = page["/Contents"]
+        if isinstance(original.get_object(), ArrayObject):
+            contents.extend(original.get_object())
+        else:
+            contents.append(original)
+    push, pop = DecodedStreamObject(), DecodedStreamObject()
+    push.set_data(b"q\n")
+    pop.set_data(f"\nQ\nq {name} Do Q\n".encode())
+    page[NameObject("/Contents")] = ArrayObject([writer._add_object(push)] + contents + [writer._add_object(pop)])
+
+def write_searchable_pdf(pdf_path, target_dir, total_pages, ocr_pages, mode, results, worker_stats):
+    # Takes the results of the OCR'd pages of this PDF, in page order, from results; the other
+    # pages are copied from the original as they are
+    output_path = os.path.join(target_dir, os.path.basename(pdf_path))  # Save with original filename
+    source = woo_largefile.open_pdf_reader(pdf_path)
+    ocr_pages = set(ocr_pages)
+    merger = PdfWriter()
+    # PdfWriter tells the source readers apart by id(), so a reader that is garbage collected
+    # before the write can have its id reused by the next one, whose objects then get mixed up
+    # with its own. Keep them all alive until the PDF is written.
+    readers = []
+    skipped = {woo_ocr.PAGE_BLANK: 0, woo_ocr.PAGE_REDACTED: 0}
+    escalations = improved = 0
+    grafts = []
+
+    for source_page_num in range(1, total_pages + 1):
+        if source_page_num not in ocr_pages:
+            print(f"Copying page {source_page_num} of {total_pages}: has a text layer")
+            merger.add_page(source.pages[source_page_num - 1])
+            continue
+
+        page_num, page_pdf, page_class, dpi, escalation, seconds, worker = next(results)
+        if escalation is not None:
+            escalations += 1
+            improved += escalation
+            print(f"Processing page {page_num} of {total_pages}: low confidence, OCR'd again, kept {dpi} DPI")
+        elif page_class == woo_ocr.PAGE_CONTENT:
+            print(f"Processing page {page_num} of {total_pages}")
+        else:
+            print(f"Processing page {page_num} of {total_pages}: {page_class}, skipping OCR")
+            skipped[page_class] += 1
+        pages, busy = worker_stats.get(worker, (0, 0.0))
+        worker_stats[worker] = (pages + 1, busy + seconds)
+
+        if mode == MODE_GRAFT:
+            # The original page, the text layer is added once all pages are OCR'd
+            source_page = source.pages[source_page_num - 1]
+            grafts.append((merger.add_page(source_page), source_page, page_pdf))
+            continue
 
-        packet.seek(0)
-        
         # Create a new PDF with reportlab's output
-        new_pdf = PdfReader(packet)
+        new_pdf = PdfReader(io.BytesIO(page_pdf))
+        readers.append(new_pdf)
         page = new_pdf.pages[0]
-    
+        # The page is as large as the image in pixels, scale it back to the size of the original
+        page.scale_by(72 / dpi)
+
         merger.add_page(page)
 
-    with open(output_path, "wb") as out:
+    if grafts:
+        text_layer = build_text_layer([(source_page, layer) for _, source_page, layer in grafts])
+        for (page, _, _), layer_page in zip(grafts, text_layer.pages):
+            graft_text_layer(merger, page, layer_page)
+
+    # Through a temporary file, the original is still being read from
+    with open(output_path + ".tmp", "wb") as out:
         merger.write(out)
+    source.stream.close()
+    os.replace(output_path + ".tmp", output_path)
 
     print(f"Searchable and selectable PDF saved to {output_path}")
+    print(f"Pages copied with their text layer: {total_pages - len(ocr_pages)}, OCR'd: {len(ocr_pages)}")
+    print(f"Pages skipped without OCR: blank: {skipped[woo_ocr.PAGE_BLANK]}, redacted: {skipped[woo_ocr.PAGE_REDACTED]}")
+    print(f"Pages OCR'd again at a higher DPI: {escalations}, improved: {improved}")
 
+def process_pdfs(pdf_files, target_dir, workers=1, mode=MODE_GRAFT, dpi=DPI, high_dpi=0, min_conf=MIN_CONF):
+    # pdf_files holds (pdf_path, total_pages, ocr_pages) as returned by classify_pages. Pages are
+    # OCR'd at dpi, and those with a mean word confidence below min_conf again at high_dpi.
+    start_time = time.time()
+    worker_stats = {}
 
-def process_directory(directory):
+    pool = None
+    if workers > 1:
+        # One stream of pages over all files, so the workers move on to the next file while the
+        # last pages of the current one are still being OCR'd
+        pool = multiprocessing.Pool(workers, initializer=init_ocr_worker)
+        jobs = ((pdf_path, page_num, dpi, mode, high_dpi, min_conf) for pdf_path, _, ocr_pages in pdf_files for page_num in ocr_pages)
+        results = pool.imap(ocr_page_job, jobs)
+    try:
+        for pdf_path, total_pages, ocr_pages in pdf_files:
+            print(f"OCR'ing {os.path.basename(pdf_path)}, {len(ocr_pages)} of {total_pages} pages")
+            if pool is None:
+                results = ocr_pages_serial(pdf_path, ocr_pages, dpi, mode, high_dpi, min_conf)
+            write_searchable_pdf(pdf_path, target_dir, total_pages, ocr_pages, mode, results, worker_stats)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    total_time = time.time() - start_time
+    total_pages = sum(len(ocr_pages) for _, _, ocr_pages in pdf_files)
+    print(f"OCR'd {len(pdf_files)} PDF's, {total_pages} pages in {total_time:.2f} seconds "
+          f"({total_pages / total_time if total_time > 0 else 0:.2f} pages/s)")
+    for worker, (pages, busy) in sorted(worker_stats.items()):
+        print(f"  {worker}: {pages} pages, {pages / busy if busy > 0 else 0:.2f} pages/s")
+
+
+def process_directory(directory, workers=1, **ocr_options):
     non_searchable_dir = os.path.join(directory, "non-searchable")
     if not os.path.exists(non_searchable_dir):
         os.makedirs(non_searchable_dir)
@@ -102,29 +380,56 @@ def process_directory(directory):
     total_files = len(pdf_files)
     print(f"Found {total_files} PDF files in {directory} to process.")
     item_number = 0
+    to_process = []
     
     for index, pdf_file in enumerate(pdf_files, start=1):
         item_number = item_number + 1
         # print(f"---- ({item_number}/{total_files}) ----")
         pdf_path = os.path.join(directory, pdf_file)
-        if not is_pdf_searchable(pdf_path):
+        total_pages, ocr_pages = classify_pages(pdf_path)
+        if ocr_pages:
             # First, copy the original PDF to the non-searchable directory
             new_name = os.path.splitext(pdf_file)[0] + "_ns.pdf"
             new_path = os.path.join(non_searchable_dir, new_name)
             shutil.copy(pdf_path, new_path)
-            print(f"({item_number}/{total_files}) Copied {pdf_file} to {new_path}")
-            
-            # Then, process the PDF to make it searchable, overwriting the original
-            process_single_pdf(pdf_path, directory)
+            print(f"({item_number}/{total_files}) Copied {pdf_file} to {new_path}, "
+                  f"{len(ocr_pages)} of {total_pages} pages need OCR")
+            to_process.append((pdf_path, total_pages, ocr_pages))
         else:
             print(f"({item_number}/{total_files}) File {pdf_file} is already searchable. Skipping.")
 
+    # Then, process the PDF's to make them searchable, overwriting the originals
+    if to_process:
+        process_pdfs(to_process, directory, workers, **ocr_options)
+
 def main():
-    if len(sys.argv) != 2:
-        print("Usage: python woo-ocrpdf.py <pdf_file_or_directory>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="OCR non searchable PDF's, keeping a copy of the originals in a \"non-searchable\" subfolder.")
+    parser.add_argument('path', help="PDF file or folder containing PDF's.")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of worker processes OCR'ing pages in parallel, each running Tesseract "
+                             "single-threaded (default: 1).")
+    parser.add_argument('--mode', choices=MODES, default=MODE_GRAFT,
+                        help="'graft' adds the OCR'd text as an invisible layer to the original pages, 'jpeg' replaces "
+                             "the pages with a JPEG of the rendered page, as older versions did (default: graft).")
+    parser.add_argument('--dpi', type=int, default=DPI,
+                        help=f"Resolution at which pages are rendered for OCR (default: {DPI}).")
+    parser.add_argument('--high-dpi', type=int, default=0,
+                        help="OCR pages with a low mean word confidence again at this resolution, keeping the better "
+                             "result, e.g. 300 (default: off).")
+    parser.add_argument('--min-conf', type=float, default=MIN_CONF,
+                        help=f"Mean word confidence below which a page is OCR'd again at --high-dpi (default: {MIN_CONF}).")
+    parser.add_argument('--large-file', action='store_true',
+                        help="Memory-map the PDFs instead of reading them into memory.")
+    parser.add_argument('--max-memory', type=int, default=0, metavar='MB',
+                        help="Hard memory ceiling in MB, implies --large-file (default: none).")
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be at least 1.")
+    if args.large_file or args.max_memory:
+        woo_largefile.enable(args.max_memory)
+    ocr_options = {"mode": args.mode, "dpi": args.dpi, "high_dpi": args.high_dpi, "min_conf": args.min_conf}
 
-    path = sys.argv[1]
+    path = args.path
     if os.path.isfile(path):
         if path.lower().endswith('.pdf'):
             directory = os.path.dirname(path)
@@ -132,22 +437,23 @@ def main():
             if not os.path.exists(non_searchable_dir):
                 os.makedirs(non_searchable_dir)
             
-            if not is_pdf_searchable(path):
+            total_pages, ocr_pages = classify_pages(path)
+            if ocr_pages:
                 # First, copy the original PDF to the non-searchable directory
-                new_name = os.path.splitext(path)[0] + "_ns.pdf"
+                new_name = os.path.splitext(os.path.basename(path))[0] + "_ns.pdf"
                 new_path = os.path.join(non_searchable_dir, new_name)
                 shutil.copy(path, new_path)
-                print(f"Copied {path} to {new_path}")
+                print(f"Copied {path} to {new_path}, {len(ocr_pages)} of {total_pages} pages need OCR")
                 
                 # Then, process the PDF to make it searchable, overwriting the original
-                process_single_pdf(path, directory)
+                process_pdfs([(path, total_pages, ocr_pages)], directory, args.workers, **ocr_options)
             else:
                 print(f"File {os.path.basename(path)} is already searchable. Skipping.")
         else:
             print("The file provided is not a PDF.")
             
     elif os.path.isdir(path):
-        process_directory(path)
+        process_directory(path, args.workers, **ocr_options)
         
     else:
         print("Invalid path provided. It must be either a PDF file or a directory.")
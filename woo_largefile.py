@@ -0,0 +1,203 @@
+"""
+Large-file mode shared by woo-extract-docnr.py, woo-extract.py and woo-ocrpdf.py.
+
+The bundles from open.minvws.nl can be several GB. In large-file mode the scripts keep their
+memory use flat regardless of the size of a source PDF:
+- PyPDF2 reads the source through a read-only memory map instead of a copy of the whole file
+  (PdfReader(path) reads the file into memory), and drops its cache of parsed objects once the
+  pages that needed them are written.
+- PyMuPDF empties its store of decoded fonts and images every few pages. PyMuPDF already reads
+  its input from the file on demand, so it is not memory-mapped.
+
+enable() turns the mode on for the process and its workers through the WOO_LARGE_FILE environment
+variable, and can set a hard memory ceiling per process. The ceiling is RLIMIT_DATA, which unlike
+RLIMIT_AS does not count the memory-mapped input; a process exceeding it gets a MemoryError. It is
+not available on Windows.
+"""
+
+import os
+import sys
+import mmap
+import time
+import argparse
+import tempfile
+import subprocess
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Pages read since the PyMuPDF store was last emptied
+_pages_since_shrink = 0
+
+# Environment variable that turns large-file mode on, holding the memory ceiling in MB (0 for none)
+ENV_LARGE_FILE = "WOO_LARGE_FILE"
+# Pages between emptying the PyMuPDF store; emptying it after every page makes reading ten times slower
+STORE_SHRINK_PAGES = 25
+# Number of pages of the synthetic PDF of the benchmark
+BENCHMARK_PAGES = 10000
+
+def enable(max_memory_mb=0):
+    """
+    Turns large-file mode on for this process and the worker processes it starts.
+
+    :param max_memory_mb: Hard memory ceiling per process in MB, 0 for none
+    :return: False if the ceiling could not be set, True otherwise
+    """
+    os.environ[ENV_LARGE_FILE] = str(max_memory_mb)
+    if not max_memory_mb:
+        return True
+    if resource is None:
+        print("A memory ceiling is not supported on this platform, continuing without one.")
+        return False
+    limit = max_memory_mb * 1024 * 1024
+    soft, hard = resource.getrlimit(resource.RLIMIT_DATA)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_DATA, (limit, hard))
+    return True
+
+def enabled():
+    return os.environ.get(ENV_LARGE_FILE) is not None
+
+def map_file(path):
+    """
+    :return: Read-only memory map of the whole file; closing it is left to the garbage collector
+             as readers keep referring to it
+    """
+    with open(path, 'rb') as file:
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+def open_pdf_reader(pdf_path):
+    """
+    :return: PyPDF2 PdfReader of the file, reading it through a memory map in large-file mode
+    """
+    from PyPDF2 import PdfReader
+    if enabled():
+        return PdfReader(map_file(pdf_path))
+    return PdfReader(pdf_path)
+
+def release_reader(reader):
+    """
+    Drops the objects a PdfReader parsed so far, in large-file mode. Only call this once nothing
+    still to be written refers to them; they are parsed again when needed.
+    """
+    if enabled():
+        reader.resolved_objects.clear()
+
+def release_page_cache():
+    """
+    Call after every page (or document) read with PyMuPDF. Empties the store of decoded fonts and images every
+    STORE_SHRINK_PAGES pages, in large-file mode.
+    """
+    global _pages_since_shrink
+    if not enabled():
+        return
+    _pages_since_shrink += 1
+    if _pages_since_shrink >= STORE_SHRINK_PAGES:
+        import fitz  # PyMuPDF
+        fitz.TOOLS.store_shrink(100)
+        _pages_since_shrink = 0
+
+def peak_rss_mb():
+    """
+    :return: Peak resident set size of this process in MB, None where that is not available
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+def make_synthetic_pdf(pdf_path, pages=BENCHMARK_PAGES):
+    """
+    Writes a PDF with a line of text and a different small noise image on every page, so the
+    pages share no resources.
+    """
+    import fitz  # PyMuPDF
+    with fitz.open() as doc:
+        for page_num in range(1, pages + 1):
+            page = doc.new_page()
+            page.insert_text((72, 72), f"Synthetic page {page_num} of {pages}")
+            noise = fitz.Pixmap(fitz.csGRAY, 100, 100, os.urandom(100 * 100), False)
+            page.insert_image(fitz.Rect(72, 100, 372, 400), pixmap=noise)
+        doc.save(pdf_path)
+
+def run_scenario(scenario, pdf_path):
+    """
+    Reads a PDF the way one of the scripts does, in the current mode, and prints the peak RSS.
+    Runs in a separate process per scenario, see benchmark().
+    """
+    start_time = time.time()
+    if scenario == "pypdf2":
+        # Text of every page, as woo-ocrpdf.py and woo-datespec.py read it
+        reader = open_pdf_reader(pdf_path)
+        for page in reader.pages:
+            page.extract_text()
+            release_reader(reader)
+    elif scenario == "fitz":
+        # Text and a low-resolution render of every page, as woo-extract-docnr.py reads it
+        import fitz  # PyMuPDF
+        with fitz.open(pdf_path) as doc:
+            for page in doc:
+                page.get_text()
+                page.get_pixmap(dpi=36)
+                release_page_cache()
+    print(f"{peak_rss_mb():.1f} {time.time() - start_time:.2f}")
+
+def benchmark(pdf_path=None, pages=BENCHMARK_PAGES, max_memory_mb=0):
+    """
+    Compares the peak RSS of reading a PDF with and without large-file mode. Every scenario runs in
+    a fresh process, so the peaks don't carry over.
+
+    :param pdf_path: PDF to read, a synthetic PDF of pages pages is written when None
+    :param pages: Number of pages of the synthetic PDF
+    :param max_memory_mb: Memory ceiling of the large-file runs in MB, 0 for none
+    """
+    if resource is None:
+        print("The benchmark needs the resource module, which is not available on this platform.")
+        return
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if pdf_path is None:
+            pdf_path = os.path.join(temp_dir, "synthetic.pdf")
+            start_time = time.time()
+            make_synthetic_pdf(pdf_path, pages)
+            print(f"Wrote a synthetic PDF of {pages} pages, {os.path.getsize(pdf_path) / 1024 / 1024:.1f} MB, "
+                  f"in {time.time() - start_time:.2f} seconds")
+
+        print("Benchmark (peak RSS per process):")
+        for scenario in ["pypdf2", "fitz"]:
+            for large_file in [False, True]:
+                env = dict(os.environ)
+                env.pop(ENV_LARGE_FILE, None)
+                command = [sys.executable, os.path.abspath(__file__), '--run-scenario', scenario, pdf_path]
+                if large_file:
+                    command += ['--max-memory', str(max_memory_mb)]
+                name = scenario + (" large-file" if large_file else "")
+                result = subprocess.run(command, env=env, capture_output=True, text=True)
+                if result.returncode != 0:
+                    error = result.stderr.strip().splitlines()[-1:] or [f"exit code {result.returncode}"]
+                    print(f"  {name:18} failed: {error[0]}")
+                    continue
+                peak, seconds = result.stdout.split()[-2:]
+                print(f"  {name:18} {float(peak):8.1f} MB peak RSS, {float(seconds):.2f} seconds")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Large-file mode of the woo scripts.")
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument('--benchmark', nargs='?', const='', metavar='pdf',
+                        help="Compare the peak RSS of reading a PDF with and without large-file mode "
+                             "(default: a synthetic PDF).")
+    action.add_argument('--run-scenario', nargs=2, metavar=('scenario', 'pdf'), help=argparse.SUPPRESS)
+    parser.add_argument('--pages', type=int, default=BENCHMARK_PAGES,
+                        help=f"Number of pages of the synthetic PDF (default: {BENCHMARK_PAGES}).")
+    parser.add_argument('--max-memory', type=int, default=None, metavar='MB',
+                        help="Memory ceiling of the large-file runs in MB (default: none).")
+    args = parser.parse_args()
+    if args.run_scenario:
+        if args.max_memory is not None:
+            enable(args.max_memory)
+        run_scenario(args.run_scenario[0], args.run_scenario[1])
+    else:
+        benchmark(args.benchmark or None, args.pages, args.max_memory or 0)
@@ -0,0 +1,450 @@
+"""
+Shared OCR backend for woo-extract-docnr.py and woo-ocrpdf.py.
+
+pytesseract starts a new tesseract process for every call, which reloads the language model and
+passes the image through temporary files. When tesserocr is installed, get_backend() keeps one
+Tesseract engine loaded for the lifetime of the process (so one per pool worker) and hands it
+images in memory. Without tesserocr it falls back to pytesseract.
+
+OCR results are kept in an on-disk cache keyed by a hash of the image plus the OCR settings, so
+pages that were OCR'd before (by any of the scripts) are not OCR'd again. The cache lives in
+~/.cache/woo-ocr/cache.sqlite; set WOO_OCR_CACHE to another file, or to "off" to disable it, and
+WOO_OCR_CACHE_MB to change its size limit.
+"""
+
+import os
+import time
+import json
+import sqlite3
+import hashlib
+import argparse
+import multiprocessing.util
+import numpy as np
+import pytesseract
+
+# Page segmentation mode tesseract uses when none is given
+DEFAULT_PSM = 3
+
+TSV_COLUMNS = ['level', 'page_num', 'block_num', 'par_num', 'line_num', 'word_num',
+               'left', 'top', 'width', 'height', 'conf', 'text']
+
+# Page classes of classify_image; OCR is skipped for anything but content
+PAGE_CONTENT = "content"
+PAGE_BLANK = "blank"
+PAGE_REDACTED = "redacted"
+# Resolution at which classify_image tests for redaction
+CLASSIFY_DPI = 36
+# Gray levels below which a pixel counts as ink, and as black
+INK_LEVEL = 160
+BLACK_LEVEL = 64
+# Gray level below which a pixel counts as a mark for the blank test; lighter than INK_LEVEL, so
+# gray and coloured print count
+MARK_LEVEL = 208
+# Area of marks in square points below which a page or area is blank, about a full stop in 8 pt.
+# An absolute area rather than a fraction, so a single small stamp or line of text is not blank
+BLANK_MARK_AREA = 1.0
+# A page is fully redacted when black blocks cover this fraction of it...
+REDACTED_COVERAGE = 0.3
+# ...and there is less than this fraction of ink outside those blocks
+REDACTED_REST_INK = 0.01
+# Size in pixels of the blocks that are tested for being black
+BLOCK_SIZE = 4
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "woo-ocr", "cache.sqlite")
+DEFAULT_CACHE_MB = 512
+# Cache lookups whose hit and miss counts and last use are kept in memory before they are written
+CACHE_FLUSH_LOOKUPS = 100
+
+# One backend per (name, lang) per process
+_backends = {}
+_backends_pid = None
+
+def tsv_to_dict(tsv):
+    """
+    Converts tesseract TSV output into the dict returned by pytesseract.image_to_data(output_type=DICT).
+
+    :param tsv: TSV text, with or without header line
+    :return: Dict of column name -> list of values
+    """
+    data = {column: [] for column in TSV_COLUMNS}
+    for line in tsv.splitlines():
+        fields = line.split('\t')
+        if len(fields) < len(TSV_COLUMNS) - 1 or fields[0] == 'level':
+            continue
+        fields += [''] * (len(TSV_COLUMNS) - len(fields))
+        for column, value in zip(TSV_COLUMNS, fields):
+            if column == 'text':
+                data[column].append(value)
+            elif column == 'conf':
+                data[column].append(float(value))
+            else:
+                data[column].append(int(value))
+    return data
+
+def data_to_text(data):
+    """
+    Joins the words of image_to_data output into lines of text.
+
+    :param data: Dict as returned by image_to_data
+    :return: Tuple of (text, mean word confidence or None when there are no words)
+    """
+    lines = {}
+    confs = []
+    for i, word in enumerate(data['text']):
+        if word.strip():
+            key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+            lines.setdefault(key, []).append(word)
+            confs.append(float(data['conf'][i]))
+    text = "\n".join(" ".join(words) for words in lines.values())
+    return text, (sum(confs) / len(confs) if confs else None)
+
+def classify_image(img, dpi=CLASSIFY_DPI):
+    """
+    Classifies a render of a page or page area by its ink. Pass the render that is about to be
+    OCR'd: the blank test needs the full resolution to see small or light print, the redaction
+    test runs on a copy reduced to about CLASSIFY_DPI.
+
+    :param img: PIL Image
+    :param dpi: Resolution of img
+    :return: PAGE_BLANK when there are no marks, PAGE_REDACTED when large black blocks cover
+             the page with hardly any ink besides them, PAGE_CONTENT otherwise
+    """
+    gray = img.convert("L")
+    marks = (np.asarray(gray) < MARK_LEVEL).sum()
+    if marks < BLANK_MARK_AREA * (dpi / 72) ** 2:
+        return PAGE_BLANK
+
+    gray = np.asarray(gray.reduce(max(1, round(dpi / CLASSIFY_DPI))))
+
+    # Mark the blocks that are (nearly) solid black. The rows and columns that don't fill a
+    # whole block are left out of the test altogether, their ink could never be covered by a block
+    rows, cols = gray.shape[0] // BLOCK_SIZE, gray.shape[1] // BLOCK_SIZE
+    if rows == 0 or cols == 0:
+        return PAGE_CONTENT
+    gray = gray[:rows * BLOCK_SIZE, :cols * BLOCK_SIZE]
+    ink = gray < INK_LEVEL
+    black = gray < BLACK_LEVEL
+    black_blocks = black.reshape(rows, BLOCK_SIZE, cols, BLOCK_SIZE).mean(axis=(1, 3)) > 0.9
+    coverage = black_blocks.sum() * BLOCK_SIZE * BLOCK_SIZE / gray.size
+
+    # The edges of a black block rarely line up with the block grid, so the ink of the partly
+    # covered neighbouring blocks belongs to it as well
+    grown = black_blocks.copy()
+    grown[1:, :] |= black_blocks[:-1, :]
+    grown[:-1, :] |= black_blocks[1:, :]
+    grown_rows = grown.copy()
+    grown[:, 1:] |= grown_rows[:, :-1]
+    grown[:, :-1] |= grown_rows[:, 1:]
+    block_mask = np.repeat(np.repeat(grown, BLOCK_SIZE, axis=0), BLOCK_SIZE, axis=1)
+    rest_ink = (ink & ~block_mask).sum() / gray.size
+    if coverage >= REDACTED_COVERAGE and rest_ink < REDACTED_REST_INK:
+        return PAGE_REDACTED
+    return PAGE_CONTENT
+
+class TesserocrBackend:
+    """
+    Long-lived in-process Tesseract engine through tesserocr.
+    """
+    name = "tesserocr"
+
+    def __init__(self, lang="eng"):
+        import tesserocr
+        self.lang = lang
+        self.api = tesserocr.PyTessBaseAPI(lang=lang)
+
+    def _set_image(self, img, psm):
+        self.api.SetPageSegMode(DEFAULT_PSM if psm is None else psm)
+        self.api.SetImage(img)
+
+    def image_to_string(self, img, psm=None, dpi=None):
+        self._set_image(img, psm)
+        return self.api.GetUTF8Text()
+
+    def image_to_string_conf(self, img, psm=None, dpi=None):
+        self._set_image(img, psm)
+        text = self.api.GetUTF8Text()
+        return text, (float(self.api.MeanTextConf()) if text.strip() else None)
+
+    def image_to_data(self, img, psm=None, dpi=None):
+        self._set_image(img, psm)
+        return tsv_to_dict(self.api.GetTSVText(0))
+
+class PytesseractBackend:
+    """
+    Fallback backend, runs one tesseract process per call.
+    """
+    name = "pytesseract"
+
+    def __init__(self, lang="eng"):
+        self.lang = lang
+
+    def _config(self, psm):
+        return '' if psm is None else f'--psm {psm}'
+
+    def image_to_string(self, img, psm=None, dpi=None):
+        return pytesseract.image_to_string(img, lang=self.lang, config=self._config(psm))
+
+    def image_to_string_conf(self, img, psm=None, dpi=None):
+        # One tesseract run for both, rather than image_to_string followed by image_to_data
+        return data_to_text(self.image_to_data(img, psm))
+
+    def image_to_data(self, img, psm=None, dpi=None):
+        return pytesseract.image_to_data(img, lang=self.lang, config=self._config(psm),
+                                         output_type=pytesseract.Output.DICT)
+
+BACKENDS = {backend.name: backend for backend in (TesserocrBackend, PytesseractBackend)}
+
+class OcrCache:
+    """
+    On-disk OCR result cache in SQLite, shared by all processes and scripts using it.
+
+    Entries are evicted least recently used first once the cache grows over max_mb. Hit and miss
+    counts are kept in the cache file, so the hit rate covers all runs. Lookups only read: their
+    counts and last use are written in batches, with the next put or every CACHE_FLUSH_LOOKUPS
+    lookups, and when the process exits. The total size of the entries is kept in the stats table,
+    so a put doesn't have to add up the sizes of all entries.
+    """
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_mb=DEFAULT_CACHE_MB):
+        self.path = path
+        self.max_bytes = max_mb * 1024 * 1024
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT, size INTEGER, last_used REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER)")
+        self.db.execute("INSERT OR IGNORE INTO stats VALUES ('hits', 0), ('misses', 0)")
+        # Caches written before the total was kept get it computed once
+        self.db.execute("INSERT OR IGNORE INTO stats SELECT 'bytes', COALESCE(SUM(size), 0) FROM entries")
+        self.db.commit()
+        self.used = {}
+        self.hits = 0
+        self.misses = 0
+        # Also runs when a pool worker exits, unlike atexit
+        multiprocessing.util.Finalize(self, self.flush, exitpriority=10)
+
+    @staticmethod
+    def key(img, settings):
+        """
+        :param img: PIL Image that is OCR'd
+        :param settings: Dict of the OCR settings that influence the result
+        :return: Hex digest identifying the image and settings
+        """
+        digest = hashlib.sha256()
+        digest.update(json.dumps([img.mode, img.size, settings], sort_keys=True).encode())
+        digest.update(img.tobytes())
+        return digest.hexdigest()
+
+    def get(self, key):
+        row = self.db.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.used[key] = time.time()
+        if self.hits + self.misses >= CACHE_FLUSH_LOOKUPS:
+            self.flush()
+        return None if row is None else json.loads(row[0])
+
+    def _write_lookups(self):
+        # Writes the lookups kept in memory, in the current transaction
+        if self.used:
+            self.db.executemany("UPDATE entries SET last_used = ? WHERE key = ?",
+                                [(used, key) for key, used in self.used.items()])
+        if self.hits:
+            self.db.execute("UPDATE stats SET value = value + ? WHERE name = 'hits'", (self.hits,))
+        if self.misses:
+            self.db.execute("UPDATE stats SET value = value + ? WHERE name = 'misses'", (self.misses,))
+        self.used, self.hits, self.misses = {}, 0, 0
+
+    def flush(self):
+        """
+        Writes the hit and miss counts and last use of the lookups since the last write.
+        """
+        if self.used or self.hits or self.misses:
+            self._write_lookups()
+            self.db.commit()
+
+    def put(self, key, value):
+        value = json.dumps(value)
+        # Take the write lock first, so the size of an entry replaced can't change before it is subtracted
+        self.db.execute("BEGIN IMMEDIATE")
+        row = self.db.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+        self._write_lookups()
+        self.db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", (key, value, len(value), time.time()))
+        self.db.execute("UPDATE stats SET value = value + ? WHERE name = 'bytes'", (len(value) - (row[0] if row else 0),))
+        self.db.commit()
+        self.evict()
+
+    def evict(self):
+        total = self.db.execute("SELECT value FROM stats WHERE name = 'bytes'").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Drop the least recently used entries until the cache is back at 90% of its limit
+        freed = 0
+        while total - freed > self.max_bytes * 0.9:
+            rows = self.db.execute("SELECT key, size FROM entries ORDER BY last_used LIMIT 1000").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if total - freed <= self.max_bytes * 0.9:
+                    break
+                # Another process may have evicted the entry already
+                if self.db.execute("DELETE FROM entries WHERE key = ?", (key,)).rowcount:
+                    freed += size
+        self.db.execute("UPDATE stats SET value = value - ? WHERE name = 'bytes'", (freed,))
+        self.db.commit()
+
+    def stats(self):
+        """
+        :return: Dict with the number of entries, their size in bytes and the hit and miss totals
+        """
+        self.flush()
+        entries = self.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        totals = dict(self.db.execute("SELECT name, value FROM stats").fetchall())
+        return {"entries": entries, "bytes": totals.get("bytes", 0), "hits": totals.get("hits", 0),
+                "misses": totals.get("misses", 0)}
+
+    def clear(self):
+        self.used, self.hits, self.misses = {}, 0, 0
+        self.db.execute("DELETE FROM entries")
+        self.db.execute("UPDATE stats SET value = 0")
+        self.db.commit()
+        self.db.execute("VACUUM")
+
+class CachedBackend:
+    """
+    Wraps a backend, answering from the OcrCache when the same image was OCR'd with the same settings.
+    """
+    def __init__(self, backend, cache):
+        self.backend = backend
+        self.cache = cache
+        self.name = backend.name
+        self.lang = backend.lang
+
+    def _cached(self, method, img, psm, dpi):
+        key = self.cache.key(img, {"method": method, "psm": psm, "dpi": dpi, "lang": self.lang})
+        value = self.cache.get(key)
+        if value is None:
+            value = getattr(self.backend, method)(img, psm=psm, dpi=dpi)
+            self.cache.put(key, value)
+        return value
+
+    def image_to_string(self, img, psm=None, dpi=None):
+        return self._cached("image_to_string", img, psm, dpi)
+
+    def image_to_string_conf(self, img, psm=None, dpi=None):
+        return tuple(self._cached("image_to_string_conf", img, psm, dpi))
+
+    def image_to_data(self, img, psm=None, dpi=None):
+        return self._cached("image_to_data", img, psm, dpi)
+
+def get_cache():
+    """
+    :return: The OcrCache configured by WOO_OCR_CACHE and WOO_OCR_CACHE_MB, or None when it is "off"
+    """
+    path = os.environ.get("WOO_OCR_CACHE", DEFAULT_CACHE_PATH)
+    if path.lower() == "off":
+        return None
+    return OcrCache(path, int(os.environ.get("WOO_OCR_CACHE_MB", DEFAULT_CACHE_MB)))
+
+def get_backend(lang="eng", name=None):
+    """
+    Returns the OCR backend of the current process, creating it on first use.
+
+    :param lang: Tesseract language
+    :param name: "tesserocr" or "pytesseract"; defaults to the WOO_OCR_BACKEND environment variable,
+                 or tesserocr when it is installed
+    :return: Backend with image_to_string(img, psm=None, dpi=None), image_to_string_conf(img, psm=None, dpi=None)
+             returning (text, mean confidence), and image_to_data(img, psm=None, dpi=None). dpi is the
+             resolution the image was rendered at and is part of the cache key.
+    """
+    global _backends_pid
+    if _backends_pid != os.getpid():
+        # A forked worker must not reuse the engine or cache connection of its parent
+        _backends.clear()
+        _backends_pid = os.getpid()
+
+    name = name or os.environ.get("WOO_OCR_BACKEND")
+    key = (name, lang)
+    if key not in _backends:
+        if name == PytesseractBackend.name:
+            backend = PytesseractBackend(lang)
+        else:
+            try:
+                backend = TesserocrBackend(lang)
+            except (ImportError, RuntimeError):
+                if name == TesserocrBackend.name:
+                    raise
+                backend = PytesseractBackend(lang)
+        cache = get_cache()
+        _backends[key] = CachedBackend(backend, cache) if cache else backend
+    return _backends[key]
+
+def benchmark(pdf_path, pages=50, dpi=300, box=120):
+    """
+    Compares crops per second of the available backends on the top-right corners of a PDF.
+
+    :param pdf_path: PDF file to take the crops from
+    :param pages: Number of pages to take a crop from
+    :param dpi: Render resolution of the crops
+    :param box: Size of the corner crop in PDF points
+    """
+    import fitz  # PyMuPDF
+    from PIL import Image
+
+    crops = []
+    with fitz.open(pdf_path) as doc:
+        for page in doc.pages(0, min(pages, len(doc))):
+            r = page.rect
+            pix = page.get_pixmap(matrix=fitz.Matrix(dpi / 72, dpi / 72), clip=fitz.Rect(r.x1 - box, r.y0, r.x1, r.y0 + box))
+            crops.append(Image.frombytes("RGB", [pix.width, pix.height], pix.samples))
+    print(f"Benchmarking {len(crops)} corner crops of {os.path.basename(pdf_path)} at {dpi} DPI")
+
+    texts = {}
+    for name in BACKENDS:
+        try:
+            backend = BACKENDS[name]()
+        except (ImportError, RuntimeError) as e:
+            print(f"{name:12} not available: {e}")
+            continue
+        start_time = time.time()
+        texts[name] = [backend.image_to_string(crop) for crop in crops]
+        elapsed_time = time.time() - start_time
+        print(f"{name:12} {len(crops) / elapsed_time:8.2f} crops/s ({elapsed_time:.2f} seconds)")
+
+    if len(texts) == len(BACKENDS):
+        differences = sum(a.strip() != b.strip() for a, b in zip(*texts.values()))
+        print(f"Crops with different text between backends: {differences}")
+
+def print_cache_stats():
+    cache = get_cache()
+    if cache is None:
+        print("The OCR cache is disabled (WOO_OCR_CACHE=off).")
+        return
+    stats = cache.stats()
+    lookups = stats["hits"] + stats["misses"]
+    print(f"OCR cache: {cache.path}")
+    print(f"Entries: {stats['entries']}, size: {stats['bytes'] / 1024 / 1024:.1f} of {cache.max_bytes / 1024 / 1024:.0f} MB")
+    print(f"Lookups: {lookups}, hits: {stats['hits']}, misses: {stats['misses']}, "
+          f"hit rate: {stats['hits'] / lookups * 100 if lookups else 0:.1f}%")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shared OCR backend of the woo scripts.")
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument('--benchmark', metavar='pdf',
+                        help="Compare crops per second of the OCR backends on the corners of this PDF.")
+    action.add_argument('--cache-stats', action='store_true', help="Show the size and hit rate of the OCR cache.")
+    action.add_argument('--cache-clear', action='store_true', help="Remove all entries from the OCR cache.")
+    parser.add_argument('--pages', type=int, default=50, help="Number of pages to take a crop from (default: 50).")
+    parser.add_argument('--dpi', type=int, default=300, help="Render resolution of the crops (default: 300).")
+    args = parser.parse_args()
+    if args.cache_stats:
+        print_cache_stats()
+    elif args.cache_clear:
+        cache = get_cache()
+        if cache:
+            cache.clear()
+            print(f"Cleared the OCR cache {cache.path}")
+    else:
+        benchmark(args.benchmark, args.pages, args.dpi)